@@ -0,0 +1,35 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from .profiling import profiled_queries
+
+
+def in_thread_pool(view):
+    """Async-версия синхронного view для ASGI.
+
+    Django 3.2 под ASGI выполняет все синхронные view в одном общем
+    потоке, поэтому медленный запрос к базе задерживает остальные.
+    Здесь view вместе с рендерингом ответа уходит в пул потоков, а
+    соединение с базой открывается и закрывается так же, как на
+    запрос под WSGI. Асинхронного ORM в Django 3.2 нет.
+    """
+
+    def run(request, *args, **kwargs):
+        close_old_connections()
+        try:
+            with profiled_queries():
+                response = view(request, *args, **kwargs)
+                if callable(getattr(response, 'render', None)):
+                    response.render()
+            return response
+        finally:
+            close_old_connections()
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        return await sync_to_async(run, thread_sensitive=False)(
+            request, *args, **kwargs)
+
+    return async_view
@@ -0,0 +1,73 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+from .replicas import route_user_reads
+
+
+def token_cache_key(key):
+    # В ключ кеша не попадает сам токен.
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def forget_tokens(*keys):
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+class CacheStats:
+    """Попадания и промахи кеша токенов в текущем процессе."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def hit(self):
+        with self.lock:
+            self.hits += 1
+
+    def miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def as_dict(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {'hits': hits, 'misses': misses,
+                'hit_rate': round(hits / total, 3) if total else None}
+
+
+token_cache_stats = CacheStats()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который ищет пользователя по токену сначала в
+    кеше на ``AUTH_TOKEN_CACHE_TIMEOUT`` секунд; 0 выключает кеш.
+
+    Запись удаляется при удалении токена (logout в djoser, удаление
+    пользователя) и при любом сохранении пользователя, в том числе при
+    деактивации; см. ``api.signals``. Недавно писавший пользователь
+    читает с основной базы, см. ``api.replicas``.
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            route_user_reads(result[0])
+        return result
+
+    def authenticate_credentials(self, key):
+        if settings.AUTH_TOKEN_CACHE_TIMEOUT <= 0:
+            return super().authenticate_credentials(key)
+        cache_key = token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is not None:
+            token_cache_stats.hit()
+            return token.user, token
+        token_cache_stats.miss()
+        user, token = super().authenticate_credentials(key)
+        cache.set(cache_key, token, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        return user, token
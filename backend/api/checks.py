@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+@register()
+def token_cache_check(app_configs, **kwargs):
+    """Кеш токенов в памяти процесса не сбрасывается в других процессах:
+    выход или деактивация пользователя действуют там только по истечении
+    ``AUTH_TOKEN_CACHE_TIMEOUT``."""
+    if settings.AUTH_TOKEN_CACHE_TIMEOUT > 0 and settings.LOCAL_CACHE:
+        return [Warning(
+            'Кеш токенов включён при кеше в памяти процесса.',
+            hint='Задайте общий CACHE_BACKEND или запускайте один процесс; '
+                 'AUTH_TOKEN_CACHE_TIMEOUT=0 выключает кеш токенов.',
+            id='api.W001')]
+    return []
@@ -1,32 +1,63 @@
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django_filters import rest_framework
-from recipes.models import Recipes
-from rest_framework.filters import SearchFilter
+from recipes.models import Recipes, Tags
+from recipes.search import search_recipes
+from recipes.versions import TAGS, get_version
+
+from .user_state import FAVORITE, SHOPPING_CART, get_user_state
 
 User = get_user_model()
 
 
-class NameSearchFilter(SearchFilter):
-    search_param = 'name'
+def get_tag_ids():
+    """Словарь slug -> id всех тегов, кэшируется до изменения тегов."""
+    key = f'tag-ids:{get_version(TAGS)}'
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tags.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids, timeout=None)
+    return tag_ids
+
+
+def tag_choices():
+    return [(slug, slug) for slug in get_tag_ids()]
 
 
 class RecipeFilter(rest_framework.FilterSet):
-    author = rest_framework.ModelChoiceFilter(queryset=User.objects.all())
-    tags = rest_framework.AllValuesMultipleFilter(field_name='tags__slug')
+    author = rest_framework.ModelChoiceFilter(
+        queryset=User.objects.only('id'))
+    tags = rest_framework.MultipleChoiceFilter(
+        choices=tag_choices, method='filter_tags')
     is_favorited = rest_framework.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = rest_framework.BooleanFilter(
         method='filter_is_in_shopping_cart')
+    search = rest_framework.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipes
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search')
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        tag_ids = get_tag_ids()
+        return queryset.filter(pk__in=Recipes.tags.through.objects.filter(
+            tags_id__in=[tag_ids[slug] for slug in value],
+        ).values('recipes_id'))
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(favorite__user=self.request.user)
+            return queryset.filter(
+                pk__in=get_user_state(self.request)[FAVORITE])
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(shopping_cart__user=self.request.user)
+            return queryset.filter(
+                pk__in=get_user_state(self.request)[SHOPPING_CART])
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
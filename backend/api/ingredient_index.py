@@ -0,0 +1,63 @@
+from bisect import bisect_left, bisect_right
+from threading import Lock
+
+from recipes.models import Ingredient
+from recipes.versions import INGREDIENTS, get_version
+
+
+class IngredientIndex:
+    """Отсортированный по названию индекс ингредиентов в памяти процесса.
+
+    Строится при первом обращении и перестраивается, когда меняется
+    версия каталога в базе (сигналы модели, load_ingredients), см.
+    recipes/versions.py.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.version = None
+        self.items = []
+        self.keys = []
+        self.by_name = []
+        self.by_id = {}
+
+    def refresh(self):
+        version = get_version(INGREDIENTS)
+        if version == self.version:
+            return
+        with self.lock:
+            if version == self.version:
+                return
+            items = [
+                {'id': pk, 'name': name, 'measurement_unit': unit}
+                for pk, name, unit in Ingredient.objects.order_by(
+                    'pk').values_list('id', 'name', 'measurement_unit')
+            ]
+            by_name = sorted(items,
+                             key=lambda item: (item['name'].lower(),
+                                               item['id']))
+            self.keys = [item['name'].lower() for item in by_name]
+            self.by_name = by_name
+            self.items = items
+            self.by_id = {item['id']: item for item in items}
+            self.version = version
+
+    def search(self, name=''):
+        self.refresh()
+        name = name.strip().lower()
+        if not name:
+            return self.items
+        keys, by_name = self.keys, self.by_name
+        start = bisect_left(keys, name)
+        end = bisect_right(keys, name + '\U0010ffff', lo=start)
+        contains = [item for key, item in zip(keys, by_name)
+                    if name in key and not key.startswith(name)]
+        return by_name[start:end] + contains
+
+    def find(self, ids):
+        self.refresh()
+        by_id = self.by_id
+        return [by_id[pk] for pk in ids if pk in by_id]
+
+
+ingredient_index = IngredientIndex()
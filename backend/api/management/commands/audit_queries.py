@@ -0,0 +1,122 @@
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from recipes.feed import Timeline
+from recipes.models import Recipes
+from recipes.pantry import changed_recipes
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.management.dataset import (add_dataset_arguments, seed_dataset,
+                                    test_database)
+from api.pagination import CustomPagination
+from api.views import MyUserViewSet, RecipeViewSet
+
+SEQ_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(
+        r'\bSCAN (?:TABLE )?(\w+)(?!.*\b(?:USING|VIRTUAL TABLE)\b)'),
+}
+# Псевдонимы таблиц в подзапросах Django (U0, V1, ...): SQLite пишет в
+# плане псевдоним вместо имени таблицы.
+ALIAS_PATTERN = re.compile(r'"(\w+)" (?:AS )?([A-Z]\d+)\b')
+# Справочники из нескольких строк планировщик честно читает целиком.
+SMALL_TABLES = {'recipes_tags'}
+PAGE_SIZE = 6
+
+
+def make_view(viewset, user, params=None, action='list'):
+    request = Request(APIRequestFactory().get('/', params or {}))
+    request.user = user
+    return viewset(request=request, args=(), kwargs={}, action=action,
+                   format_kwarg=None)
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN запросов RecipeViewSet, RecipeFilter и MyUserViewSet '
+            'на синтетических данных: поиск последовательных сканов')
+
+    def add_arguments(self, parser):
+        add_dataset_arguments(parser, recipes=5000)
+        parser.add_argument('--show-plans', action='store_true')
+        parser.add_argument('--fail', action='store_true',
+                            help='Код выхода 1, если найдены сканы')
+
+    def handle(self, *args, **options):
+        pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f'{connection.vendor} не поддерживается.')
+        with test_database(options['keepdb']):
+            state = seed_dataset(options)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            found = {}
+            for label, queryset in self.get_querysets(state):
+                plan = queryset.explain()
+                sql, _ = queryset.query.sql_with_params()
+                aliases = {alias: table
+                           for table, alias in ALIAS_PATTERN.findall(sql)}
+                tables = {aliases.get(name, name)
+                          for name in pattern.findall(plan)} - SMALL_TABLES
+                if tables:
+                    found[label] = tables
+                    self.stdout.write(self.style.WARNING(
+                        f'{label}: seq scan {", ".join(sorted(tables))}'))
+                else:
+                    self.stdout.write(f'{label}: ok')
+                if options['show_plans']:
+                    self.stdout.write(plan + '\n')
+        if found and options['fail']:
+            raise CommandError(f'Последовательные сканы: {len(found)}')
+
+    def get_querysets(self, state):
+        user = state['user']
+        recipe_filters = (
+            ('RecipeViewSet.list', {}),
+            ('RecipeFilter.author', {'author': state['author_id']}),
+            ('RecipeFilter.tags',
+             {'tags': [state['tag_slug'], state['other_tag_slug']]}),
+            ('RecipeFilter.is_favorited', {'is_favorited': '1'}),
+            ('RecipeFilter.is_in_shopping_cart',
+             {'is_in_shopping_cart': '1'}),
+            ('RecipeFilter.search', {'search': state['search']}),
+        )
+        for label, params in recipe_filters:
+            view = make_view(RecipeViewSet, user, params)
+            yield label, view.filter_queryset(
+                view.get_queryset())[:PAGE_SIZE]
+
+        view = make_view(RecipeViewSet, user)
+        last = view.get_queryset().order_by('-pub_date', '-id')[PAGE_SIZE]
+        paginator = CustomPagination()
+        paginator.ordering = RecipeViewSet.keyset_ordering
+        yield 'RecipeViewSet.list (cursor)', view.get_queryset().order_by(
+            *paginator.ordering).filter(paginator.keyset_filter(
+                [last.pub_date, last.id]))[:PAGE_SIZE]
+        for number, source in enumerate(
+                Timeline.for_user(user.id).sources, 1):
+            yield f'RecipeViewSet.feed ({number})', source[:PAGE_SIZE]
+        yield 'RecipeViewSet.retrieve', view.get_queryset().filter(
+            pk=state['recipe_id'])
+        yield 'RecipeViewSet.similar', Recipes.objects.filter(
+            similar_to__recipe_id=state['recipe_id']).order_by(
+            '-similar_to__score', 'id')
+        yield 'PantryIndex.refresh', changed_recipes(
+            timezone.now() - timedelta(seconds=settings.COOK_INDEX_LAG))
+        yield ('RecipeViewSet.download_shopping_cart',
+               view.get_shopping_cart_queryset())
+
+        view = make_view(MyUserViewSet, user)
+        yield 'MyUserViewSet.list', view.get_queryset().order_by(
+            'id')[:PAGE_SIZE]
+        view = make_view(MyUserViewSet, user, {'recipes_limit': 3},
+                         action='subscriptions')
+        subscriptions = view.get_subscriptions_queryset()
+        yield 'MyUserViewSet.subscriptions', subscriptions[:PAGE_SIZE]
+        authors = list(subscriptions.values_list('id', flat=True)[:PAGE_SIZE])
+        yield ('MyUserViewSet.subscriptions (recipes)',
+               view.get_subscription_recipes().filter(author__in=authors))
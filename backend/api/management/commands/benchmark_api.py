@@ -0,0 +1,286 @@
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, URLResolver, resolve
+from rest_framework.test import APIClient
+
+from api import urls
+from api.management.dataset import (PASSWORD, add_dataset_arguments,
+                                    seed_dataset, test_database)
+
+BUDGETS_FILE = Path(__file__).resolve().parents[2] / 'benchmark_budgets.json'
+# Столько id в запросах к массовым эндпоинтам.
+BULK_SIZE = 20
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAQMAAAAl'
+         '21bKAAAAA1BMVEUAAACnej3aAAAAAXRSTlMAQObYZgAAAApJREFUCNdjYAAAAAIAA'
+         'eIhvDMAAAAASUVORK5CYII=')
+
+# Маршруты, которые требуют писем (uid/token) или прав staff,
+# в прогон не входят.
+SKIPPED_ROUTES = {
+    'slow-requests', 'token-cache-stats', 'user-activation',
+    'user-resend-activation', 'user-reset-password',
+    'user-reset-password-confirm',
+    'user-reset-username', 'user-reset-username-confirm',
+    'user-set-username',
+}
+
+
+def recipe_payload(state):
+    return {
+        'name': 'Бенчмарк',
+        'text': 'Рецепт для замера',
+        'cooking_time': 10,
+        'image': IMAGE,
+        'tags': state['tag_ids'][:2],
+        'ingredients': [{'id': pk, 'amount': 5}
+                        for pk in state['ingredient_ids'][:10]],
+    }
+
+
+def recipe_patch_payload(state):
+    return {
+        'cooking_time': 20,
+        'ingredients': [{'id': pk, 'amount': 7}
+                        for pk in state['ingredient_ids'][5:15]],
+    }
+
+
+def new_user_payload(state):
+    state['signup'] += 1
+    return {
+        'email': f'signup{state["signup"]}@benchmark.local',
+        'username': f'signup{state["signup"]}',
+        'first_name': 'Имя',
+        'last_name': 'Фамилия',
+        'password': PASSWORD,
+    }
+
+
+# (название, метод, url, данные, клиент, ключ для сохранения id ответа)
+SCENARIOS = (
+    ('api-root', 'get', '/api/', None, 'user', None),
+    ('login', 'post', '/api/auth/token/login/',
+     lambda state: {'email': state['spare_email'], 'password': PASSWORD},
+     'anon', 'spare_token'),
+    ('logout', 'post', '/api/auth/token/logout/', None, 'spare', None),
+    ('user-list', 'get', '/api/users/?limit={limit}', None, 'user', None),
+    ('user-list', 'post', '/api/users/', new_user_payload, 'anon', None),
+    ('user-me', 'get', '/api/users/me/', None, 'user', None),
+    ('user-detail', 'get', '/api/users/{author_id}/', None, 'user', None),
+    ('user-set-password', 'post', '/api/users/set_password/',
+     {'current_password': PASSWORD, 'new_password': PASSWORD},
+     'user', None),
+    ('user-subscriptions', 'get',
+     '/api/users/subscriptions/?limit={limit}&recipes_limit=3', None,
+     'user', None),
+    ('user-subscribe', 'post', '/api/users/{unfollowed_id}/subscribe/',
+     None, 'user', None),
+    ('user-subscribe', 'delete', '/api/users/{unfollowed_id}/subscribe/',
+     None, 'user', None),
+    ('user-subscribe-bulk', 'post', '/api/users/subscribe/',
+     lambda state: {'ids': state['author_ids'][-BULK_SIZE:]}, 'user', None),
+    ('user-subscribe-bulk', 'delete', '/api/users/subscribe/',
+     lambda state: {'ids': state['author_ids'][-BULK_SIZE:]}, 'user', None),
+    ('ingredients-list', 'get', '/api/ingredients/?name={prefix}', None,
+     'anon', None),
+    ('ingredients-detail', 'get', '/api/ingredients/{ingredient_id}/',
+     None, 'anon', None),
+    ('tags-list', 'get', '/api/tags/', None, 'anon', None),
+    ('tags-detail', 'get', '/api/tags/{tag_id}/', None, 'anon', None),
+    ('recipes-list-anonymous', 'get', '/api/recipes/?limit={limit}', None,
+     'anon', None),
+    ('recipes-list', 'get', '/api/recipes/?limit={limit}', None, 'user',
+     None),
+    ('recipes-list-cursor', 'get',
+     '/api/recipes/?limit={limit}&pagination=cursor', None, 'user', None),
+    ('recipes-list-filtered', 'get',
+     '/api/recipes/?limit={limit}&tags={tag_slug}&tags={other_tag_slug}'
+     '&is_favorited=1', None, 'user', None),
+    ('recipes-list-by-author', 'get',
+     '/api/recipes/?limit={limit}&author={author_id}'
+     '&is_in_shopping_cart=1', None, 'user', None),
+    ('recipes-list-search', 'get',
+     '/api/recipes/?limit={limit}&search={search}', None, 'user', None),
+    ('recipes-detail', 'get', '/api/recipes/{recipe_id}/', None, 'user',
+     None),
+    ('recipes-similar', 'get',
+     '/api/recipes/{recipe_id}/similar/?recipes_limit={limit}', None,
+     'anon', None),
+    ('recipes-cook', 'get',
+     '/api/recipes/cook/?limit={limit}&ingredients={ingredient_id}'
+     '&tags={tag_slug}', None, 'user', None),
+    ('recipes-feed', 'get', '/api/recipes/feed/?limit={limit}', None,
+     'user', None),
+    ('recipes-list', 'post', '/api/recipes/', recipe_payload, 'user',
+     'new_recipe_id'),
+    ('recipes-detail', 'patch', '/api/recipes/{new_recipe_id}/',
+     recipe_patch_payload, 'user', None),
+    ('recipes-favorite', 'post', '/api/recipes/{new_recipe_id}/favorite/',
+     None, 'user', None),
+    ('recipes-favorite', 'delete',
+     '/api/recipes/{new_recipe_id}/favorite/', None, 'user', None),
+    ('recipes-shopping-cart', 'post',
+     '/api/recipes/{new_recipe_id}/shopping_cart/', None, 'user', None),
+    ('recipes-shopping-cart', 'delete',
+     '/api/recipes/{new_recipe_id}/shopping_cart/', None, 'user', None),
+    ('recipes-favorite-bulk', 'post', '/api/recipes/favorite/',
+     lambda state: {'ids': state['recipe_ids'][-BULK_SIZE:]}, 'user', None),
+    ('recipes-favorite-bulk', 'delete', '/api/recipes/favorite/',
+     lambda state: {'ids': state['recipe_ids'][-BULK_SIZE:]}, 'user', None),
+    ('recipes-shopping-cart-bulk', 'post', '/api/recipes/shopping_cart/',
+     lambda state: {'ids': state['recipe_ids'][-BULK_SIZE:]}, 'user', None),
+    ('recipes-shopping-cart-bulk', 'delete', '/api/recipes/shopping_cart/',
+     lambda state: {'ids': state['recipe_ids'][-BULK_SIZE:]}, 'user', None),
+    ('recipes-download-shopping-cart', 'get',
+     '/api/recipes/download_shopping_cart/', None, 'user', None),
+    ('recipes-detail', 'delete', '/api/recipes/{new_recipe_id}/', None,
+     'user', None),
+)
+
+
+def route_names(patterns):
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names |= route_names(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+class Command(BaseCommand):
+    help = ('Замер количества SQL-запросов, времени и размера ответа '
+            'для каждого маршрута API на синтетических данных')
+
+    def add_arguments(self, parser):
+        add_dataset_arguments(parser)
+        parser.add_argument('--limit', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--budgets', default=BUDGETS_FILE)
+        parser.add_argument('--update-budgets', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['users'] < 3 or options['recipes'] < 1:
+            raise CommandError('Нужно минимум 3 пользователя и 1 рецепт.')
+        with test_database(options['keepdb']), \
+                tempfile.TemporaryDirectory() as media_root, \
+                override_settings(
+                    MEDIA_ROOT=media_root,
+                    IMAGE_PROCESSING='queue',
+                    SIMILAR_PROCESSING='queue',
+                    # Бюджеты считаются для боевой настройки с общим
+                    # кешем; замер идёт в одном процессе.
+                    AUTH_TOKEN_CACHE_TIMEOUT=60,
+                    CATALOG_VERSION_TIMEOUT=300,
+                    EMAIL_BACKEND='django.core.mail.backends.'
+                                  'locmem.EmailBackend'):
+            state = seed_dataset(options)
+            state.update(limit=options['limit'], signup=0)
+            results = self.run_scenarios(state, options)
+        self.report(results)
+        self.check_coverage()
+        if options['update_budgets']:
+            self.update_budgets(results, options['budgets'])
+        else:
+            self.check_budgets(results, options['budgets'])
+
+    def get_client(self, state, kind):
+        client = APIClient()
+        token = state.get(f'{kind}_token')
+        if token:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        return client
+
+    def run_scenarios(self, state, options):
+        results = {}
+        self.covered = set()
+        for _ in range(options['repeat']):
+            for name, method, url, data, kind, store in SCENARIOS:
+                if callable(data):
+                    data = data(state)
+                url = url.format(**state)
+                self.covered.add(resolve(url.split('?')[0]).url_name)
+                client = self.get_client(state, kind)
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = getattr(client, method)(url, data,
+                                                       format='json')
+                    if response.streaming:
+                        size = sum(len(chunk)
+                                   for chunk in response.streaming_content)
+                    else:
+                        size = len(response.content)
+                    elapsed = (time.perf_counter() - start) * 1000
+                if response.status_code >= 400:
+                    raise CommandError(
+                        f'{method.upper()} {url}: {response.status_code} '
+                        f'{response.content[:500]!r}')
+                if store:
+                    payload = response.json()
+                    state[store] = (payload.get('id')
+                                    or payload.get('auth_token'))
+                result = results.setdefault(
+                    f'{method.upper()} {name}',
+                    {'queries': 0, 'ms': [], 'bytes': 0})
+                result['queries'] = max(result['queries'], len(queries))
+                result['ms'].append(elapsed)
+                result['bytes'] = max(result['bytes'], size)
+        for result in results.values():
+            result['ms'] = statistics.median(result['ms'])
+        return results
+
+    def report(self, results):
+        self.stdout.write(f'{"маршрут":<45}{"запросы":>9}'
+                          f'{"мс":>10}{"байты":>10}')
+        for key, result in results.items():
+            self.stdout.write(f'{key:<45}{result["queries"]:>9}'
+                              f'{result["ms"]:>10.1f}{result["bytes"]:>10}')
+
+    def check_coverage(self):
+        missing = (route_names(urls.urlpatterns) - self.covered
+                   - SKIPPED_ROUTES)
+        if missing:
+            self.stdout.write(self.style.WARNING(
+                'Маршруты без замера: ' + ', '.join(sorted(missing))))
+
+    def load_budgets(self, path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def update_budgets(self, results, path):
+        budgets = self.load_budgets(path)
+        for key, result in results.items():
+            budgets.setdefault(key, {})['queries'] = result['queries']
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(budgets, file, ensure_ascii=False, indent=4,
+                      sort_keys=True)
+            file.write('\n')
+        self.stdout.write(self.style.SUCCESS(f'Бюджеты записаны в {path}'))
+
+    def check_budgets(self, results, path):
+        budgets = self.load_budgets(path)
+        errors = []
+        for key, result in results.items():
+            budget = budgets.get(key)
+            if budget is None:
+                errors.append(f'{key}: нет бюджета')
+                continue
+            if result['queries'] > budget['queries']:
+                errors.append(f'{key}: {result["queries"]} запросов '
+                              f'при бюджете {budget["queries"]}')
+            if 'ms' in budget and result['ms'] > budget['ms']:
+                errors.append(f'{key}: {result["ms"]:.1f} мс '
+                              f'при бюджете {budget["ms"]}')
+        if errors:
+            raise CommandError('Превышены бюджеты:\n' + '\n'.join(errors))
+        self.stdout.write(self.style.SUCCESS('Все маршруты в бюджете'))
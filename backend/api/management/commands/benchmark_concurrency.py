@@ -0,0 +1,149 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from api.management.dataset import (add_dataset_arguments, seed_dataset,
+                                    test_database)
+
+# (название, url, нужен ли токен пользователя)
+READ_SCENARIOS = (
+    ('recipes-list', '/api/recipes/?limit={limit}', True),
+    ('recipes-detail', '/api/recipes/{recipe_id}/', True),
+    ('tags-list', '/api/tags/', False),
+    ('ingredients-list', '/api/ingredients/?name={prefix}', False),
+    ('user-subscriptions',
+     '/api/users/subscriptions/?limit={limit}&recipes_limit=3', True),
+)
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = ('Сравнение пропускной способности маршрутов чтения при '
+            'параллельных запросах: синхронные view в пуле потоков '
+            '(WSGI), они же под ASGI и асинхронные маршруты '
+            'foodgram.urls_async (ASGI)')
+
+    def add_arguments(self, parser):
+        add_dataset_arguments(parser)
+        parser.add_argument('--limit', type=int, default=6)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на каждый маршрут.')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='Одновременных запросов (потоков WSGI).')
+        parser.add_argument('--query-latency', type=float, default=0,
+                            help='Задержка на каждый SQL-запрос, мс: '
+                                 'имитация сетевой базы данных.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 3 or options['recipes'] < 1:
+            raise CommandError('Нужно минимум 3 пользователя и 1 рецепт.')
+        with test_database(options['keepdb']):
+            state = seed_dataset(options)
+            state['limit'] = options['limit']
+            requests = [
+                (name, url.format(**state),
+                 state['user_token'] if auth else None)
+                for name, url, auth in READ_SCENARIOS
+                for _ in range(options['requests'])]
+            self.add_latency(options['query_latency'])
+            try:
+                results = {
+                    'wsgi': self.run_wsgi(requests, options['concurrency']),
+                    'asgi-sync': self.run_asgi(
+                        requests, options['concurrency'], 'foodgram.urls'),
+                    'asgi': self.run_asgi(
+                        requests, options['concurrency'],
+                        'foodgram.urls_async'),
+                }
+            finally:
+                connection_created.disconnect(dispatch_uid=__name__)
+        self.report(results)
+
+    def add_latency(self, latency):
+        if not latency:
+            return
+
+        def delay(execute, sql, params, many, context):
+            time.sleep(latency / 1000)
+            return execute(sql, params, many, context)
+
+        def install(connection, **kwargs):
+            connection.execute_wrappers.append(delay)
+
+        connection_created.connect(install, weak=False,
+                                   dispatch_uid=__name__)
+        for conn in connections.all():
+            if conn.connection is not None:
+                install(conn)
+
+    def check_response(self, response, url):
+        if response.status_code >= 400:
+            raise CommandError(f'GET {url}: {response.status_code} '
+                               f'{response.content[:500]!r}')
+
+    def run_wsgi(self, requests, concurrency):
+        def get(request):
+            name, url, token = request
+            headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+            start = time.perf_counter()
+            response = Client().get(url, **headers)
+            elapsed = (time.perf_counter() - start) * 1000
+            self.check_response(response, url)
+            return name, elapsed
+
+        with override_settings(ROOT_URLCONF='foodgram.urls'):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as executor:
+                timings = list(executor.map(get, requests))
+            return timings, time.perf_counter() - start
+
+    def run_asgi(self, requests, concurrency, urlconf):
+        async def get(request, semaphore):
+            name, url, token = request
+            headers = {'authorization': f'Token {token}'} if token else {}
+            async with semaphore:
+                start = time.perf_counter()
+                response = await AsyncClient().get(url, **headers)
+                elapsed = (time.perf_counter() - start) * 1000
+            self.check_response(response, url)
+            return name, elapsed
+
+        async def run():
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(concurrency))
+            semaphore = asyncio.Semaphore(concurrency)
+            start = time.perf_counter()
+            timings = await asyncio.gather(
+                *(get(request, semaphore) for request in requests))
+            return timings, time.perf_counter() - start
+
+        with override_settings(ROOT_URLCONF=urlconf):
+            return asyncio.run(run())
+
+    def report(self, results):
+        self.stdout.write(f'{"режим":<11}{"маршрут":<22}{"запросы":>9}'
+                          f'{"p50 мс":>10}{"p95 мс":>10}')
+        for mode, (timings, seconds) in results.items():
+            by_route = {}
+            for name, elapsed in timings:
+                by_route.setdefault(name, []).append(elapsed)
+            for name, values in by_route.items():
+                self.stdout.write(
+                    f'{mode:<11}{name:<22}{len(values):>9}'
+                    f'{statistics.median(values):>10.1f}'
+                    f'{percentile(values, 0.95):>10.1f}')
+        for mode, (timings, seconds) in results.items():
+            self.stdout.write(self.style.SUCCESS(
+                f'{mode}: {len(timings)} запросов за {seconds:.2f} с, '
+                f'{len(timings) / seconds:.0f} запросов/с'))
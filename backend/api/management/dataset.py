@@ -0,0 +1,151 @@
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection, connections
+from recipes.catalog import load_catalog
+from recipes.feed import rebuild_feeds
+from recipes.models import (AmountIngredients, Ingredient, IsFavorite,
+                            IsInShoppingCartModel, Recipes, Tags)
+from recipes.shopping_list import rebuild_shopping_lists
+from recipes.similar import rebuild_similar
+from recipes.versions import INGREDIENTS, TAGS, bump_version
+from rest_framework.authtoken.models import Token
+from users.models import Follow, User
+
+INGREDIENTS_FILE = settings.BASE_DIR / 'data' / 'ingredients.csv'
+PASSWORD = 'benchmark-password'
+DISHES = ('Борщ', 'Плов', 'Омлет', 'Салат', 'Суп', 'Пирог', 'Каша')
+
+
+def add_dataset_arguments(parser, recipes=300):
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--recipes', type=int, default=recipes)
+    parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+    parser.add_argument('--follows', type=int, default=20)
+    parser.add_argument('--favorites', type=int, default=40)
+    parser.add_argument('--cart', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ingredients-file', default=INGREDIENTS_FILE)
+    parser.add_argument('--keepdb', action='store_true')
+
+
+@contextmanager
+def test_database(keepdb=False):
+    """Отдельная тестовая база на время замеров.
+
+    Реплики из ``DATABASE_REPLICAS`` на это время смотрят в неё же.
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, keepdb=keepdb)
+    replicas = {alias: connections[alias].settings_dict.copy()
+                for alias in settings.DATABASE_REPLICAS}
+    for alias in replicas:
+        connections[alias].close()
+        connections[alias].creation.set_as_test_mirror(
+            connection.settings_dict)
+    try:
+        yield
+    finally:
+        for alias, settings_dict in replicas.items():
+            connections[alias].close()
+            connections[alias].settings_dict = settings_dict
+        connection.creation.destroy_test_db(
+            old_name, verbosity=0, keepdb=keepdb)
+
+
+def seed_dataset(options):
+    """Заполняет базу синтетическими данными и возвращает их ключи."""
+    rnd = random.Random(options['seed'])
+    cache.clear()
+    with open(options['ingredients_file'], encoding='utf-8',
+              newline='') as file:
+        load_catalog(INGREDIENTS, file, 'csv')
+    ingredient_ids = list(
+        Ingredient.objects.values_list('id', flat=True))
+
+    Tags.objects.bulk_create(
+        Tags(name=name, color=color, slug=slug)
+        for name, color, slug in (('Завтрак', '#E26C2D', 'breakfast'),
+                                  ('Обед', '#49B64E', 'lunch'),
+                                  ('Ужин', '#8775D2', 'dinner')))
+    bump_version(TAGS)
+    tags = list(Tags.objects.values_list('id', 'slug'))
+
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(
+        User(email=f'user{i}@benchmark.local', username=f'user{i}',
+             first_name='Имя', last_name='Фамилия', password=password)
+        for i in range(options['users']))
+    user_ids = list(User.objects.order_by('id').values_list(
+        'id', flat=True))
+    user = User.objects.get(id=user_ids[0])
+    spare = User.objects.get(id=user_ids[1])
+    unfollowed_id = user_ids[2]
+    authors = user_ids[3:] or [user.id]
+
+    Recipes.objects.bulk_create(
+        Recipes(author_id=rnd.choice(authors),
+                name=f'{rnd.choice(DISHES)} {i}',
+                image='uploads/benchmark.png',
+                text='Описание рецепта ' * 20,
+                cooking_time=rnd.randint(1, 120))
+        for i in range(options['recipes']))
+    recipe_ids = list(Recipes.objects.values_list('id', flat=True))
+
+    Recipes.tags.through.objects.bulk_create(
+        Recipes.tags.through(recipes_id=recipe_id, tags_id=tag_id)
+        for recipe_id in recipe_ids
+        for tag_id, _ in rnd.sample(tags, rnd.randint(1, len(tags))))
+    AmountIngredients.objects.bulk_create(
+        AmountIngredients(recipe_id=recipe_id, ingredient_id=pk,
+                          amount=rnd.randint(1, 500))
+        for recipe_id in recipe_ids
+        for pk in rnd.sample(
+            ingredient_ids,
+            min(options['ingredients_per_recipe'],
+                len(ingredient_ids))))
+    # Основной пользователь получает заданное число строк, остальные —
+    # случайную долю, чтобы в таблицах были данные разных пользователей.
+    for user_id in user_ids:
+        share = 1 if user_id == user.id else rnd.random()
+        Follow.objects.bulk_create(
+            Follow(user_id=user_id, author_id=author_id)
+            for author_id in rnd.sample(
+                authors, int(min(options['follows'], len(authors)) * share))
+            if author_id != user_id)
+        IsFavorite.objects.bulk_create(
+            IsFavorite(user_id=user_id, recipe_id=recipe_id)
+            for recipe_id in rnd.sample(
+                recipe_ids,
+                int(min(options['favorites'], len(recipe_ids)) * share)))
+        IsInShoppingCartModel.objects.bulk_create(
+            IsInShoppingCartModel(user_id=user_id, recipe_id=recipe_id)
+            for recipe_id in rnd.sample(
+                recipe_ids,
+                int(min(options['cart'], len(recipe_ids)) * share)))
+    rebuild_feeds()
+    rebuild_similar()
+    rebuild_shopping_lists()
+
+    return {
+        'user': user,
+        'user_token': Token.objects.create(user=user).key,
+        'spare_email': spare.email,
+        'unfollowed_id': unfollowed_id,
+        'author_id': authors[0],
+        'author_ids': authors,
+        'recipe_id': recipe_ids[0],
+        'recipe_ids': recipe_ids,
+        'ingredient_id': ingredient_ids[0],
+        'ingredient_ids': ingredient_ids,
+        'prefix': Ingredient.objects.get(id=ingredient_ids[0]).name[:2],
+        'tag_id': tags[0][0],
+        'tag_ids': [tag_id for tag_id, _ in tags],
+        'tag_slug': tags[0][1],
+        'other_tag_slug': tags[-1][1],
+        'search': DISHES[0].lower(),
+    }
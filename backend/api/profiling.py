@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+MAX_QUERIES = 100
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = timezone.now()
+        self.start = time.perf_counter()
+        self.queries = []
+        self.query_count = 0
+        self.timings = {'sql': 0.0, 'view': 0.0, 'serializer': 0.0,
+                        'render': 0.0}
+        self.depth = 0
+        self.view_start = None
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            self.timings['sql'] += duration
+            self.query_count += 1
+            if len(self.queries) < MAX_QUERIES:
+                self.queries.append({'sql': sql, 'ms': round(duration, 2)})
+
+    def total(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self):
+        return ', '.join([
+            f'sql;dur={self.timings["sql"]:.1f};'
+            f'desc="{self.query_count} queries"',
+            f'view;dur={self.timings["view"]:.1f}',
+            f'serializer;dur={self.timings["serializer"]:.1f}',
+            f'render;dur={self.timings["render"]:.1f}',
+            f'total;dur={self.total():.1f}',
+        ])
+
+
+@contextmanager
+def timed(name):
+    """Добавляет время блока к метрике ``name`` текущего запроса.
+
+    Вложенные блоки (сериализатор внутри сериализатора) не считаются
+    повторно.
+    """
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    profile.depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.depth -= 1
+        if not profile.depth:
+            profile.timings[name] += (time.perf_counter() - start) * 1000
+
+
+class TimedSerializerMixin:
+    """Время ``to_representation`` сериализатора в метрике
+    ``serializer``.
+
+    У ``many=True`` считается каждый объект списка, вложенные
+    сериализаторы и блоки ``timed`` вокруг них не считаются повторно.
+    """
+
+    def to_representation(self, instance):
+        with timed('serializer'):
+            return super().to_representation(instance)
+
+
+class SlowRequests:
+    """Последние медленные запросы процесса, не больше ``size`` штук."""
+
+    def __init__(self, size):
+        self.lock = threading.Lock()
+        self.items = deque(maxlen=size)
+
+    def add(self, item):
+        with self.lock:
+            self.items.append(item)
+
+    def slowest(self):
+        with self.lock:
+            items = list(self.items)
+        return sorted(items, key=lambda item: item['total_ms'], reverse=True)
+
+
+slow_requests = SlowRequests(settings.PROFILING_BUFFER_SIZE)
+
+
+@contextmanager
+def profiled_queries():
+    """Считает SQL текущего потока в профиль запроса.
+
+    Соединения с базой у каждого потока свои, поэтому обёртку ставит
+    поток, который выполняет запросы: middleware для синхронных view,
+    ``api.async_views`` для view в пуле потоков под ASGI.
+    """
+    profile = current_profile.get()
+    with ExitStack() as stack:
+        if profile is not None:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(profile.execute))
+        yield
+
+
+class ProfilingMiddleware:
+    """SQL, view, сериализация и рендеринг запроса в заголовке
+    Server-Timing.
+
+    Включается настройкой ``PROFILING``. ``view`` — время обработчика
+    вместе с сериализацией, ``serializer`` — сериализаторы с
+    ``TimedSerializerMixin`` и размеченные ``timed`` блоки внутри него,
+    ``render`` — время рендереров ``api.renderers``. Запросы дольше
+    ``PROFILING_SLOW_MS`` вместе с их SQL попадают в ``slow_requests``.
+    У потоковых ответов заголовок отражает время до первого байта, а в
+    буфер запрос попадает после отдачи всего тела.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        stack = ExitStack()
+        stack.enter_context(profiled_queries())
+        try:
+            response = self.get_response(request)
+        except Exception:
+            stack.close()
+            raise
+        finally:
+            current_profile.reset(token)
+        if profile.view_start is not None:
+            profile.timings['view'] = (
+                (time.perf_counter() - profile.view_start) * 1000
+                - profile.timings['render'])
+        response['Server-Timing'] = profile.server_timing()
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, request, response, profile,
+                stack)
+        else:
+            stack.close()
+            self.record(request, response, profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.view_start = time.perf_counter()
+
+    def stream(self, content, request, response, profile, stack):
+        try:
+            yield from content
+        finally:
+            stack.close()
+            self.record(request, response, profile)
+
+    def record(self, request, response, profile):
+        total = profile.total()
+        if total < settings.PROFILING_SLOW_MS:
+            return
+        slow_requests.add({
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'user': getattr(request.user, 'pk', None),
+            'started': profile.started.isoformat(),
+            'total_ms': round(total, 1),
+            'sql_ms': round(profile.timings['sql'], 1),
+            'view_ms': round(profile.timings['view'], 1),
+            'serializer_ms': round(profile.timings['serializer'], 1),
+            'render_ms': round(profile.timings['render'], 1),
+            'query_count': profile.query_count,
+            'queries': profile.queries,
+        })
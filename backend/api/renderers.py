@@ -0,0 +1,64 @@
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .profiling import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class PlainTextRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            if not isinstance(data, str):
+                data = json.dumps(data, ensure_ascii=False)
+            return data.encode(self.charset)
+
+
+class CSVRenderer(PlainTextRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JSONStreamRenderer(PlainTextRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson, если он установлен.
+
+    Вывод совпадает с JSONRenderer байт в байт: компактные разделители,
+    кириллица без экранирования, U+2028 и U+2029 экранированы, даты,
+    Decimal и ленивые строки кодируются энкодером DRF. Отступы (например,
+    для BrowsableAPI) и всё, что orjson не умеет, уходят в JSONRenderer.
+    """
+    options = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+               if orjson else 0)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return self.render_json(data, accepted_media_type,
+                                    renderer_context)
+
+    def render_json(self, data, accepted_media_type, renderer_context):
+        if (orjson is None or data is None or not self.compact
+                or self.get_indent(accepted_media_type,
+                                   renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=self.options)
+        except TypeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace(
+            '\u2029'.encode(), b'\\u2029')
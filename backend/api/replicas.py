@@ -0,0 +1,88 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+# Токены, сессии, группы и права читаются только с основной базы:
+# только что выданный токен или созданная сессия могут ещё не дойти до
+# реплики, и запрос сразу после входа не будет аутентифицирован.
+PRIMARY_APPS = {'authtoken', 'sessions', 'auth'}
+# Справочники и их версии тоже читаются с основной базы: кеши по версии
+# (индекс ингредиентов, id тегов, ETag) живут дольше запроса, и снимок с
+# отстающей реплики остался бы в них под новой версией.
+PRIMARY_MODELS = {'recipes.ingredient', 'recipes.tags',
+                  'recipes.catalogversion'}
+
+read_database = ContextVar('read_database', default=None)
+
+
+def pin_key(user_id):
+    return f'primary-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    cache.set(pin_key(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def route_user_reads(user):
+    """Пользователь, недавно менявший данные, читает с основной базы."""
+    database = read_database.get()
+    if database not in (None, DEFAULT_DB_ALIAS) and cache.get(
+            pin_key(user.pk)):
+        read_database.set(DEFAULT_DB_ALIAS)
+
+
+class ReplicaRouter:
+    """Чтение в запросах GET/HEAD/OPTIONS уходит на реплику, выбранную
+    ``ReplicaMiddleware``; запись и всё остальное — на основную базу."""
+
+    def db_for_read(self, model, **hints):
+        if (model._meta.app_label in PRIMARY_APPS
+                or model._meta.label_lower in PRIMARY_MODELS):
+            return DEFAULT_DB_ALIAS
+        return read_database.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    """Выбирает базу для чтения на время запроса.
+
+    Безопасный запрос читает с одной случайной реплики из
+    ``DATABASE_REPLICAS``. После успешного изменяющего запроса
+    пользователь ``REPLICA_STICKY_SECONDS`` секунд читает с основной
+    базы и видит свои изменения, даже если реплика отстаёт. Отметка
+    хранится в кеше, поэтому при нескольких процессах нужен общий кеш.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in SAFE_METHODS:
+            database = random.choice(settings.DATABASE_REPLICAS)
+        else:
+            database = DEFAULT_DB_ALIAS
+        token = read_database.set(database)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_database.reset(token)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin_to_primary(user.pk)
+        return response
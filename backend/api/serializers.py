@@ -1,14 +1,50 @@
-from django.db.models import F
+from django.core.files.storage import default_storage
+from django.db import transaction
 from djoser.serializers import UserSerializer
 from drf_extra_fields.fields import Base64ImageField
-from recipes.models import (AmountIngredients, Ingredient, IsFavorite,
-                            IsInShoppingCartModel, Recipes, Tags)
+from recipes.feed import fan_out_recipe
+from recipes.models import AmountIngredients, Ingredient, Recipes, Tags
+from recipes.images import (VARIANT_FORMAT, delete_variants,
+                            schedule_image_processing)
+from recipes.shopping_list import change_carted_recipe
+from recipes.similar import schedule_similar_update
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from users.models import Follow, User
+from users.models import User
 
+from .profiling import TimedSerializerMixin
+from .user_state import FAVORITE, FOLLOW, SHOPPING_CART, get_user_state
 
-class MyUserSerializer(UserSerializer):
+# Сколько id принимают массовые эндпоинты избранного, покупок и подписок.
+BULK_IDS_LIMIT = 100
+
+
+def recipe_image_url(request, image, variants, variant):
+    path = (variants or {}).get(variant, {}).get(VARIANT_FORMAT) or image
+    if not path:
+        return None
+    url = default_storage.url(path)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+class RecipeImageField(serializers.ImageField):
+    """Отдаёт уменьшенную копию картинки, пока её нет или без
+    ``variant`` — оригинал."""
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return recipe_image_url(
+            self.context.get('request'), value.name,
+            getattr(value.instance, 'image_variants', None), self.variant)
+
+
+class MyUserSerializer(TimedSerializerMixin, UserSerializer):
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
@@ -28,18 +64,18 @@ class MyUserSerializer(UserSerializer):
         return user
 
     def get_is_subscribed(self, obj):
-        user = None
-        request = self.context.get("request")
-        if request and hasattr(request, "user"):
-            user = request.user
-            if user.is_anonymous:
-                return False
-        return Follow.objects.filter(user=user, author=obj).exists()
+        return obj.id in get_user_state(self.context.get('request'))[FOLLOW]
+
+
+def get_recipes_limit(request):
+    try:
+        limit = int(request.query_params.get('recipes_limit'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return limit if limit >= 0 else None
 
 
 class FollowSerializer(MyUserSerializer):
-    recipes_count = serializers.IntegerField(source='recipes.count',
-                                             read_only=True)
     recipes = serializers.SerializerMethodField(method_name='get_recipes')
     is_subscribed = serializers.BooleanField(default=True)
 
@@ -53,25 +89,30 @@ class FollowSerializer(MyUserSerializer):
 
     def get_recipes(self, obj):
         recipes = obj.recipes.all()
+        if 'recipes' not in getattr(obj, '_prefetched_objects_cache', {}):
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit is not None:
+                recipes = recipes[:limit]
         serializer = ShortRecipeSerializer(recipes, many=True,
                                            context=self.context)
         return serializer.data
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
 
 
-class TagsSerializer(serializers.ModelSerializer):
+class TagsSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Tags
         fields = ('id', 'name', 'color', 'slug')
 
 
-class AmountIngredientsSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+class AmountIngredientsSerializer(TimedSerializerMixin,
+                                  serializers.ModelSerializer):
+    id = serializers.IntegerField()
     name = serializers.ReadOnlyField(source='ingredient.name')
     measurement_unit = serializers.ReadOnlyField(
         source='ingredient.measurement_unit')
@@ -86,11 +127,11 @@ class AmountIngredientsSerializer(serializers.ModelSerializer):
         return data
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     tags = TagsSerializer(read_only=True, many=True)
     author = MyUserSerializer(read_only=True)
     ingredients = serializers.SerializerMethodField()
-    image = Base64ImageField()
+    image = RecipeImageField()
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
@@ -98,37 +139,83 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         model = Recipes
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart', 'name',
-                  'image', 'text', 'cooking_time')
+                  'image', 'text', 'cooking_time', 'favorites_count')
 
     def get_ingredients(self, recipe):
-        return recipe.ingredients.values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('amount_ingr__amount'))
+        amounts = recipe.amount.all()
+        if 'amount' not in getattr(recipe, '_prefetched_objects_cache', {}):
+            amounts = amounts.select_related('ingredient')
+        return [
+            {'id': amount_ingr.ingredient.id,
+             'name': amount_ingr.ingredient.name,
+             'measurement_unit': amount_ingr.ingredient.measurement_unit,
+             'amount': amount_ingr.amount}
+            for amount_ingr in amounts
+        ]
 
     def get_is_favorited(self, obj):
-        user = None
-        request = self.context.get('request')
-        if request and hasattr(request, 'user'):
-            user = request.user
-            if user.is_anonymous:
-                return False
-        return IsFavorite.objects.filter(user=user, recipe=obj).exists()
+        return obj.id in get_user_state(
+            self.context.get('request'))[FAVORITE]
 
     def get_is_in_shopping_cart(self, obj):
-        user = None
-        request = self.context.get('request')
-        if request and hasattr(request, 'user'):
-            user = request.user
-            if user.is_anonymous:
-                return False
-        return IsInShoppingCartModel.objects.filter(
-            user=user,
-            recipe=obj).exists()
-
-
-class RecipeSerializer(serializers.ModelSerializer):
+        return obj.id in get_user_state(
+            self.context.get('request'))[SHOPPING_CART]
+
+
+# Поля строк .values() для serialize_recipe_rows.
+RECIPE_ROW_FIELDS = ('id', 'name', 'image', 'image_variants', 'text',
+                     'cooking_time', 'favorites_count', 'pub_date',
+                     'author_id',
+                     'author__email', 'author__username',
+                     'author__first_name', 'author__last_name')
+
+
+def serialize_recipe_rows(rows, request):
+    """То же, что RecipeReadSerializer(many=True), но из строк .values().
+
+    Теги и ингредиенты страницы читаются двумя запросами той же формы,
+    что и prefetch_related в RecipeViewSet, поля идут в порядке
+    RecipeReadSerializer.Meta.fields. Ответ совпадает байт в байт, кроме
+    картинки: в списках — копия ``medium``, в карточке рецепта — оригинал.
+    """
+    ids = [row['id'] for row in rows]
+    tags = {recipe_id: [] for recipe_id in ids}
+    for recipe_id, *tag in Tags.objects.filter(recipes__in=ids).values_list(
+            'recipes', 'id', 'name', 'color', 'slug'):
+        tags[recipe_id].append(dict(zip(('id', 'name', 'color', 'slug'),
+                                        tag)))
+    ingredients = {recipe_id: [] for recipe_id in ids}
+    for recipe_id, *amount in AmountIngredients.objects.filter(
+            recipe__in=ids).values_list(
+            'recipe_id', 'ingredient_id', 'ingredient__name',
+            'ingredient__measurement_unit', 'amount'):
+        ingredients[recipe_id].append(dict(zip(
+            ('id', 'name', 'measurement_unit', 'amount'), amount)))
+    state = get_user_state(request)
+    return [{
+        'id': row['id'],
+        'tags': tags[row['id']],
+        'author': {
+            'id': row['author_id'],
+            'email': row['author__email'],
+            'username': row['author__username'],
+            'first_name': row['author__first_name'],
+            'last_name': row['author__last_name'],
+            'is_subscribed': row['author_id'] in state[FOLLOW],
+        },
+        'ingredients': ingredients[row['id']],
+        'is_favorited': row['id'] in state[FAVORITE],
+        'is_in_shopping_cart': row['id'] in state[SHOPPING_CART],
+        'name': row['name'],
+        'image': recipe_image_url(request, row['image'],
+                                  row['image_variants'], 'medium'),
+        'text': row['text'],
+        'cooking_time': row['cooking_time'],
+        'favorites_count': row['favorites_count'],
+    } for row in rows]
+
+
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tags.objects.all(), many=True)
     author = MyUserSerializer(required=False)
@@ -150,41 +237,85 @@ class RecipeSerializer(serializers.ModelSerializer):
         for amount_ingr in value:
             if amount_ingr['amount'] <= 0:
                 raise ValidationError('Колличество должно быть больше 0')
+        ids = [amount_ingr['id'] for amount_ingr in value]
+        if len(set(ids)) != len(ids):
+            raise ValidationError('Ингредиенты не должны повторяться.')
+        missing = set(ids) - set(Ingredient.objects.filter(
+            id__in=ids).values_list('id', flat=True))
+        if missing:
+            raise ValidationError(
+                f'Ингредиенты не найдены: {sorted(missing)}')
         return value
 
     def to_representation(self, instance):
-        serializer = RecipeReadSerializer(instance)
+        serializer = RecipeReadSerializer(instance, context=self.context)
         return serializer.data
 
+    @transaction.atomic
     def create(self, validated_data):
         author = self.context.get('request').user
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = Recipes.objects.create(author=author, **validated_data)
         recipe.tags.set(tags)
-        for ingredient in ingredients:
-            AmountIngredients.objects.create(recipe=recipe,
-                                             ingredient=ingredient.get('id'),
-                                             amount=ingredient.get('amount'))
+        schedule_image_processing(recipe)
+        AmountIngredients.objects.bulk_create(
+            AmountIngredients(recipe=recipe,
+                              ingredient_id=ingredient['id'],
+                              amount=ingredient['amount'])
+            for ingredient in ingredients)
+        fan_out_recipe(recipe)
+        schedule_similar_update()
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        amounts = {ingredient['id']: ingredient['amount']
+                   for ingredient in ingredients}
+        existing = AmountIngredients.objects.filter(recipe=recipe)
+        existing.exclude(ingredient_id__in=amounts).delete()
+        changed = []
+        for amount_ingr in existing.filter(ingredient_id__in=amounts):
+            amount = amounts.pop(amount_ingr.ingredient_id)
+            if amount_ingr.amount != amount:
+                amount_ingr.amount = amount
+                changed.append(amount_ingr)
+        AmountIngredients.objects.bulk_update(changed, ('amount',))
+        AmountIngredients.objects.bulk_create(
+            AmountIngredients(recipe=recipe, ingredient_id=ingredient_id,
+                              amount=amount)
+            for ingredient_id, amount in amounts.items())
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags', None)
         if tags is not None:
             instance.tags.set(tags)
         ingredients = validated_data.pop('ingredients', None)
         if ingredients is not None:
-            instance.ingredients.clear()
-            for ingredient in ingredients:
-                amount = ingredient['amount']
-                AmountIngredients.objects.update_or_create(
-                    recipe=instance,
-                    ingredient=ingredient.get('id'),
-                    defaults={'amount': amount})
+            change_carted_recipe(instance.id, -1)
+            self.update_ingredients(instance, ingredients)
+            change_carted_recipe(instance.id, 1)
+        if 'image' in validated_data:
+            delete_variants(instance.image_variants)
+            instance.image_variants = None
+            schedule_image_processing(instance)
+        if tags is not None or ingredients is not None:
+            instance.similar_updated = None
+            schedule_similar_update()
         return super().update(instance, validated_data)
 
 
-class ShortRecipeSerializer(serializers.ModelSerializer):
+class ShortRecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    image = RecipeImageField(variant='small')
+
     class Meta:
         model = Recipes
         fields = ('id', 'name', 'image', 'cooking_time')
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1),
+                                allow_empty=False, max_length=BULK_IDS_LIMIT)
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
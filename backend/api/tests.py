@@ -0,0 +1,475 @@
+from io import StringIO
+from unittest import mock
+
+from asgiref.testing import ApplicationCommunicator
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from recipes.counters import recount
+from recipes.models import (AmountIngredients, CatalogVersion, Ingredient,
+                            IsInShoppingCartModel, Recipes, ShoppingListItem,
+                            Tags)
+from recipes.relations import link
+from recipes.signals import restore_search_index
+from recipes.versions import INGREDIENTS, get_version
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+from users.models import Follow, User
+
+from .profiling import RequestProfile
+from .replicas import ReplicaRouter, read_database
+from .serializers import BULK_IDS_LIMIT
+from .user_state import get_user_state, load_user_state
+
+CART_BULK_URL = '/api/recipes/shopping_cart/'
+FAVORITE_BULK_URL = '/api/recipes/favorite/'
+SUBSCRIBE_BULK_URL = '/api/users/subscribe/'
+UNKNOWN_ID = 10 ** 6
+
+
+@override_settings(IMAGE_PROCESSING='queue', SIMILAR_PROCESSING='queue')
+class ShoppingListTestCase(APITestCase):
+    """Список покупок и счётчики после каждого шага совпадают с
+    пересборкой с нуля (``rebuild_shopping_lists --check``) и
+    пересчётом (``recount_counters``)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user', first_name='user',
+            last_name='user', password='password')
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='author', last_name='author', password='password')
+        cls.flour, cls.milk, cls.egg = (
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name, unit in (('мука', 'г'), ('молоко', 'мл'),
+                               ('яйцо', 'шт')))
+        cls.pancakes = cls.create_recipe(
+            'Блины', {cls.flour: 200, cls.milk: 500})
+        cls.omelette = cls.create_recipe(
+            'Омлет', {cls.milk: 100, cls.egg: 3})
+        recount()
+
+    @classmethod
+    def create_recipe(cls, name, amounts):
+        recipe = Recipes.objects.create(
+            author=cls.author, name=name, text=name, cooking_time=10,
+            image='recipes/images/test.png')
+        AmountIngredients.objects.bulk_create(
+            AmountIngredients(recipe=recipe, ingredient=ingredient,
+                              amount=amount)
+            for ingredient, amount in amounts.items())
+        return recipe
+
+    def setUp(self):
+        cache.clear()
+        self.cached_state()
+        self.client.force_authenticate(self.user)
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.author)
+
+    def cached_state(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        return get_user_state(request)
+
+    def shopping_list(self, user=None):
+        return dict(ShoppingListItem.objects.filter(
+            user=user or self.user).values_list('ingredient', 'amount'))
+
+    def assertConsistent(self):
+        call_command('rebuild_shopping_lists', '--check', stdout=StringIO())
+        out = StringIO()
+        call_command('recount_counters', stdout=out)
+        self.assertNotRegex(out.getvalue(), r'исправлено [1-9]')
+        self.assertEqual(self.cached_state(), load_user_state(self.user.id))
+
+    def assertInCarts(self, recipe, count):
+        recipe.refresh_from_db(fields=('in_carts_count',))
+        self.assertEqual(recipe.in_carts_count, count)
+
+    def test_add_and_remove_recipe(self):
+        url = f'/api/recipes/{self.pancakes.id}/shopping_cart/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.shopping_list(),
+                         {self.flour.id: 200, self.milk.id: 500})
+        self.client.post(f'/api/recipes/{self.omelette.id}/shopping_cart/')
+        self.assertEqual(self.shopping_list(), {
+            self.flour.id: 200, self.milk.id: 600, self.egg.id: 3})
+        self.assertConsistent()
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertInCarts(self.pancakes, 1)
+
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.shopping_list(),
+                         {self.milk.id: 100, self.egg.id: 3})
+        self.assertInCarts(self.pancakes, 0)
+        self.assertConsistent()
+
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertConsistent()
+
+    def test_edit_ingredients_of_carted_recipe(self):
+        self.client.post(f'/api/recipes/{self.pancakes.id}/shopping_cart/')
+        self.client.post(f'/api/recipes/{self.omelette.id}/shopping_cart/')
+        response = self.author_client.patch(
+            f'/api/recipes/{self.pancakes.id}/',
+            {'ingredients': [{'id': self.flour.id, 'amount': 250},
+                             {'id': self.egg.id, 'amount': 2}]},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.shopping_list(), {
+            self.flour.id: 250, self.milk.id: 100, self.egg.id: 5})
+        self.assertInCarts(self.pancakes, 1)
+        self.assertConsistent()
+
+    def test_delete_carted_recipe(self):
+        self.client.post(f'/api/recipes/{self.pancakes.id}/shopping_cart/')
+        self.client.post(f'/api/recipes/{self.omelette.id}/shopping_cart/')
+        response = self.author_client.delete(
+            f'/api/recipes/{self.pancakes.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.shopping_list(),
+                         {self.milk.id: 100, self.egg.id: 3})
+        self.assertConsistent()
+
+    def test_cascade_delete_of_author(self):
+        self.client.post(f'/api/recipes/{self.pancakes.id}/shopping_cart/')
+        self.client.post(f'/api/recipes/{self.omelette.id}/shopping_cart/')
+        self.author.delete()
+        self.assertEqual(self.shopping_list(), {})
+        self.assertConsistent()
+
+    def test_delete_outside_api(self):
+        """Рецепт и строка покупок, удалённые через ORM, как в админке."""
+        IsInShoppingCartModel.objects.create(user=self.user,
+                                             recipe=self.pancakes)
+        IsInShoppingCartModel.objects.create(user=self.user,
+                                             recipe=self.omelette)
+        self.assertEqual(self.shopping_list(), {
+            self.flour.id: 200, self.milk.id: 600, self.egg.id: 3})
+        self.assertInCarts(self.pancakes, 1)
+        IsInShoppingCartModel.objects.get(
+            user=self.user, recipe=self.omelette).delete()
+        self.assertEqual(self.shopping_list(),
+                         {self.flour.id: 200, self.milk.id: 500})
+        self.assertInCarts(self.omelette, 0)
+        self.pancakes.delete()
+        self.assertEqual(self.shopping_list(), {})
+        self.assertConsistent()
+
+    def test_bulk_duplicate_ids(self):
+        ids = [self.pancakes.id, self.omelette.id, self.pancakes.id]
+        response = self.client.post(CART_BULK_URL, {'ids': ids},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [
+            {'id': self.pancakes.id, 'status': 'added'},
+            {'id': self.omelette.id, 'status': 'added'}])
+        response = self.client.post(CART_BULK_URL, {'ids': ids},
+                                    format='json')
+        self.assertEqual(response.json(), [
+            {'id': self.pancakes.id, 'status': 'exists'},
+            {'id': self.omelette.id, 'status': 'exists'}])
+        self.assertEqual(self.shopping_list(), {
+            self.flour.id: 200, self.milk.id: 600, self.egg.id: 3})
+        self.assertInCarts(self.pancakes, 1)
+        self.assertConsistent()
+
+        response = self.client.delete(CART_BULK_URL, {'ids': ids},
+                                      format='json')
+        self.assertEqual(response.json(), [
+            {'id': self.pancakes.id, 'status': 'deleted'},
+            {'id': self.omelette.id, 'status': 'deleted'}])
+        self.assertEqual(self.shopping_list(), {})
+        self.assertInCarts(self.pancakes, 0)
+        self.assertConsistent()
+
+    def test_concurrent_bulk_posts(self):
+        """Второй запрос того же пользователя записывает свои рецепты
+        между проверкой id и INSERT первого."""
+        other_client = APIClient()
+        other_client.force_authenticate(self.user)
+        responses = []
+
+        def racing_link(*args):
+            with mock.patch('api.views.link', link):
+                responses.append(other_client.post(
+                    CART_BULK_URL, {'ids': [self.pancakes.id]},
+                    format='json'))
+            return link(*args)
+
+        with mock.patch('api.views.link', side_effect=racing_link):
+            response = self.client.post(
+                CART_BULK_URL,
+                {'ids': [self.pancakes.id, self.omelette.id]},
+                format='json')
+        self.assertEqual(responses[0].json(), [
+            {'id': self.pancakes.id, 'status': 'added'}])
+        self.assertEqual(response.json(), [
+            {'id': self.pancakes.id, 'status': 'exists'},
+            {'id': self.omelette.id, 'status': 'added'}])
+        self.assertEqual(IsInShoppingCartModel.objects.filter(
+            user=self.user).count(), 2)
+        self.assertEqual(self.shopping_list(), {
+            self.flour.id: 200, self.milk.id: 600, self.egg.id: 3})
+        self.assertInCarts(self.pancakes, 1)
+        self.assertConsistent()
+
+    def test_bulk_over_limit(self):
+        ids = [self.pancakes.id] + list(
+            range(UNKNOWN_ID, UNKNOWN_ID + BULK_IDS_LIMIT))
+        for url in (CART_BULK_URL, FAVORITE_BULK_URL, SUBSCRIBE_BULK_URL):
+            with self.subTest(url=url):
+                response = self.client.post(url, {'ids': ids},
+                                            format='json')
+                self.assertEqual(response.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.shopping_list(), {})
+        self.assertInCarts(self.pancakes, 0)
+        self.assertConsistent()
+
+    def test_bulk_unknown_ids(self):
+        ids = [UNKNOWN_ID, self.pancakes.id]
+        response = self.client.post(CART_BULK_URL, {'ids': ids},
+                                    format='json')
+        self.assertEqual(response.json(), [
+            {'id': UNKNOWN_ID, 'status': 'not_found'},
+            {'id': self.pancakes.id, 'status': 'added'}])
+        response = self.client.post(FAVORITE_BULK_URL, {'ids': ids},
+                                    format='json')
+        self.assertEqual(response.json(), [
+            {'id': UNKNOWN_ID, 'status': 'not_found'},
+            {'id': self.pancakes.id, 'status': 'added'}])
+        self.assertEqual(self.shopping_list(),
+                         {self.flour.id: 200, self.milk.id: 500})
+        self.assertConsistent()
+
+        response = self.client.delete(
+            CART_BULK_URL, {'ids': [UNKNOWN_ID, self.omelette.id]},
+            format='json')
+        self.assertEqual(response.json(), [
+            {'id': UNKNOWN_ID, 'status': 'not_found'},
+            {'id': self.omelette.id, 'status': 'absent'}])
+        self.assertEqual(self.shopping_list(),
+                         {self.flour.id: 200, self.milk.id: 500})
+        self.assertConsistent()
+
+    def test_bulk_subscribe(self):
+        ids = [self.author.id, self.user.id, UNKNOWN_ID, self.author.id]
+        response = self.client.post(SUBSCRIBE_BULK_URL, {'ids': ids},
+                                    format='json')
+        self.assertEqual(response.json(), [
+            {'id': self.author.id, 'status': 'added'},
+            {'id': self.user.id, 'status': 'self'},
+            {'id': UNKNOWN_ID, 'status': 'not_found'}])
+        response = self.client.post(SUBSCRIBE_BULK_URL, {'ids': ids},
+                                    format='json')
+        self.assertEqual(response.json()[0],
+                         {'id': self.author.id, 'status': 'exists'})
+        self.author.refresh_from_db(fields=('followers_count',))
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertConsistent()
+
+        response = self.client.delete(SUBSCRIBE_BULK_URL, {'ids': ids},
+                                      format='json')
+        self.assertEqual(response.json()[0],
+                         {'id': self.author.id, 'status': 'deleted'})
+        self.assertFalse(Follow.objects.filter(user=self.user).exists())
+        self.assertConsistent()
+
+
+class RecipeImageTestCase(APITestCase):
+    """Списки отдают копию ``medium``, карточка рецепта — оригинал."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='author', last_name='author', password='password')
+        cls.recipe = Recipes.objects.create(
+            author=author, name='Блины', text='Блины', cooking_time=10,
+            image='recipes/images/test.png',
+            image_variants={
+                'medium': {'webp': 'recipes/images/test_medium.webp'}})
+
+    def test_image_variants(self):
+        listed = self.client.get('/api/recipes/').json()['results'][0]
+        self.assertTrue(listed['image'].endswith('test_medium.webp'))
+        detail = self.client.get(f'/api/recipes/{self.recipe.id}/').json()
+        self.assertTrue(detail['image'].endswith('test.png'))
+
+
+@override_settings(FEED_FANOUT_THRESHOLD=2)
+class FeedTestCase(APITestCase):
+    """Рецепты автора, опустившегося ниже порога раскладки, остаются в
+    лентах оставшихся подписчиков."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.user, cls.reader = (
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name=name, last_name=name, password='password')
+            for name in ('author', 'user', 'reader'))
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = APIClient()
+        self.reader_client.force_authenticate(self.reader)
+        self.client.force_authenticate(self.user)
+
+    def feed_names(self):
+        response = self.reader_client.get('/api/recipes/feed/')
+        return [recipe['name'] for recipe in response.json()['results']]
+
+    def test_unfollow_below_threshold(self):
+        for client in (self.client, self.reader_client):
+            client.post(SUBSCRIBE_BULK_URL, {'ids': [self.author.id]},
+                        format='json')
+        Recipes.objects.create(
+            author=self.author, name='Блины', text='Блины',
+            cooking_time=10, image='recipes/images/test.png')
+        self.assertEqual(self.feed_names(), ['Блины'])
+
+        self.client.delete(SUBSCRIBE_BULK_URL, {'ids': [self.author.id]},
+                           format='json')
+        self.author.refresh_from_db(fields=('followers_count',))
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertEqual(self.feed_names(), ['Блины'])
+
+
+class CatalogVersionTestCase(APITestCase):
+    """Версия справочника общая для процессов и сменяется после коммита.
+
+    Другой процесс моделируется очисткой кеша."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_version_survives_cache_clear(self):
+        version = get_version(INGREDIENTS)
+        cache.clear()
+        self.assertEqual(get_version(INGREDIENTS), version)
+
+    def test_bump_after_commit(self):
+        version = get_version(INGREDIENTS)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='соль', measurement_unit='г')
+            self.assertEqual(get_version(INGREDIENTS), version)
+        self.assertNotEqual(get_version(INGREDIENTS), version)
+        cache.clear()
+        self.assertNotEqual(get_version(INGREDIENTS), version)
+
+    def test_ingredient_index_sees_other_process(self):
+        self.assertEqual(self.client.get('/api/ingredients/').json(), [])
+        with self.captureOnCommitCallbacks(execute=False):
+            Ingredient.objects.create(name='соль', measurement_unit='г')
+        cache.clear()
+        names = [item['name']
+                 for item in self.client.get('/api/ingredients/').json()]
+        self.assertEqual(names, ['соль'])
+
+    def test_tags_etag(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        cache.clear()
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tags.objects.create(name='Ужин', color='#8775D2', slug='dinner')
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([tag['slug'] for tag in response.json()],
+                         ['dinner'])
+
+
+@override_settings(PROFILING=True)
+class ProfilingTestCase(APITestCase):
+    """Время сериализаторов попадает в Server-Timing любого ответа."""
+
+    def test_serializer_timing(self):
+        Tags.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        self.client.force_authenticate(User.objects.create_user(
+            email='user@example.com', username='user', first_name='user',
+            last_name='user', password='password'))
+        for url in ('/api/tags/', '/api/users/me/'):
+            with self.subTest(url=url), mock.patch.object(
+                    RequestProfile, 'server_timing', autospec=True,
+                    return_value='') as server_timing:
+                self.client.get(url)
+            timings = server_timing.call_args[0][0].timings
+            self.assertGreater(timings['serializer'], 0)
+            self.assertLess(timings['serializer'], timings['view'])
+
+
+class ReplicaRouterTestCase(TestCase):
+    """Справочники читаются с основной базы и в запросах к реплике."""
+
+    def test_catalogs_read_from_primary(self):
+        router = ReplicaRouter()
+        token = read_database.set('replica')
+        try:
+            for model in (Ingredient, Tags, CatalogVersion):
+                self.assertEqual(router.db_for_read(model), 'default')
+            self.assertEqual(router.db_for_read(Recipes), 'replica')
+        finally:
+            read_database.reset(token)
+
+
+class SearchIndexTestCase(TestCase):
+    """После migrate поисковый индекс восстанавливается только на SQLite."""
+
+    def test_restore_only_on_sqlite(self):
+        for vendor, calls in (('sqlite', 1), ('postgresql', 0)):
+            with self.subTest(vendor=vendor), \
+                    mock.patch.object(connection, 'vendor', vendor), \
+                    mock.patch('recipes.signals.install_search') as install:
+                restore_search_index(using=connection.alias)
+            self.assertEqual(install.call_count, calls)
+
+
+@override_settings(ROOT_URLCONF='foodgram.urls_async')
+class AsgiTestCase(TestCase):
+    """Запросы через ASGI-приложение целиком, вместе с отдачей тела."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user', first_name='user',
+            last_name='user', password='password')
+        cls.token = Token.objects.create(user=cls.user)
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        ShoppingListItem.objects.create(user=cls.user, ingredient=salt,
+                                        amount=10)
+
+    async def request(self, path):
+        communicator = ApplicationCommunicator(ASGIHandler(), {
+            'type': 'http', 'method': 'GET', 'path': path,
+            'query_string': b'', 'root_path': '', 'scheme': 'http',
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+            'headers': [(b'host', b'testserver'),
+                        (b'authorization',
+                         f'Token {self.token.key}'.encode())]})
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output()
+        body = b''
+        while True:
+            message = await communicator.receive_output()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                return start['status'], body
+
+    async def test_download_shopping_cart(self):
+        status_code, body = await self.request(
+            '/api/recipes/download_shopping_cart/')
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertIn('соль', body.decode())
@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import IngridientViewSet, MyUserViewSet, RecipeViewSet, TagsViewSet
+from .views import (IngridientViewSet, MyUserViewSet, RecipeViewSet,
+                    SlowRequestsView, TagsViewSet, TokenCacheStatsView)
 
 app_name = 'api'
 
@@ -12,6 +13,10 @@ router.register('tags', TagsViewSet, basename='tags')
 router.register('recipes', RecipeViewSet, basename='recipes')
 
 urlpatterns = [
+    path('profiling/slow-requests/', SlowRequestsView.as_view(),
+         name='slow-requests'),
+    path('profiling/token-cache/', TokenCacheStatsView.as_view(),
+         name='token-cache-stats'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken'))
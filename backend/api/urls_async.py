@@ -0,0 +1,23 @@
+from django.urls import URLPattern, include, path
+
+from .async_views import in_thread_pool
+from .urls import app_name, router  # noqa: F401
+from .urls import urlpatterns as sync_urlpatterns
+
+ASYNC_ROUTES = {
+    'recipes-list', 'recipes-detail', 'tags-list', 'tags-detail',
+    'ingredients-list', 'ingredients-detail', 'user-subscriptions',
+}
+
+
+def async_pattern(pattern):
+    if pattern.name not in ASYNC_ROUTES:
+        return pattern
+    return URLPattern(pattern.pattern, in_thread_pool(pattern.callback),
+                      pattern.default_args, pattern.name)
+
+
+# Маршруты чтения идут первыми и перекрывают синхронные из api.urls.
+urlpatterns = [
+    path('', include([async_pattern(pattern) for pattern in router.urls])),
+] + sync_urlpatterns
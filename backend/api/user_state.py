@@ -0,0 +1,84 @@
+import time
+
+from django.core.cache import cache
+from django.db.models import CharField, Value
+from recipes.models import IsFavorite, IsInShoppingCartModel
+from users.models import Follow
+
+FAVORITE = 'favorite'
+SHOPPING_CART = 'shopping_cart'
+FOLLOW = 'follow'
+KINDS = (FAVORITE, SHOPPING_CART, FOLLOW)
+CACHE_TIMEOUT = 60 * 60
+
+EMPTY_STATE = {kind: frozenset() for kind in KINDS}
+
+
+def version_key(user_id):
+    return f'user-state-version:{user_id}'
+
+
+def cache_key(user_id, version):
+    return f'user-state:{user_id}:{version}'
+
+
+def state_version(user_id):
+    """Текущая версия состояния пользователя.
+
+    Пропавшая из кэша версия начинается с текущего времени, чтобы не
+    совпасть с версией ещё не вытесненного старого состояния.
+    """
+    key = version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def load_user_state(user_id):
+    """Id избранных рецептов, рецептов в корзине и авторов в подписках.
+
+    Все три множества читаются одним UNION-запросом.
+    """
+    kind = CharField()
+    rows = IsFavorite.objects.filter(user_id=user_id).values_list(
+        Value(FAVORITE, output_field=kind), 'recipe_id').union(
+        IsInShoppingCartModel.objects.filter(user_id=user_id).values_list(
+            Value(SHOPPING_CART, output_field=kind), 'recipe_id'),
+        Follow.objects.filter(user_id=user_id).values_list(
+            Value(FOLLOW, output_field=kind), 'author_id'),
+        all=True)
+    state = {kind: set() for kind in KINDS}
+    for row_kind, object_id in rows:
+        state[row_kind].add(object_id)
+    return state
+
+
+def get_user_state(request):
+    """Состояние текущего пользователя, один раз за запрос."""
+    if request is None or not request.user.is_authenticated:
+        return EMPTY_STATE
+    state = getattr(request, 'user_state', None)
+    if state is None:
+        key = cache_key(request.user.id, state_version(request.user.id))
+        state = cache.get(key)
+        if state is None:
+            state = load_user_state(request.user.id)
+            cache.set(key, state, CACHE_TIMEOUT)
+        request.user_state = state
+    return state
+
+
+def invalidate_user_state(user_id):
+    """Сбрасывает состояние после записи; следующее чтение соберёт его
+    из базы.
+
+    Версия увеличивается атомарно, поэтому состояние, прочитанное из
+    базы до записи, сохранится под старой версией и читаться не будет.
+    """
+    try:
+        cache.incr(version_key(user_id))
+    except ValueError:
+        # Версии нет — нет и закэшированного состояния.
+        pass
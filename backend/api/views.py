@@ -1,82 +1,293 @@
-from django.db.models.aggregates import Sum
-from django.shortcuts import HttpResponse, get_object_or_404
+import csv
+import json
+
+from django.db import transaction
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser import views
 from recipes.models import (AmountIngredients, Ingredient, IsFavorite,
-                            IsInShoppingCartModel, Recipes, Tags)
+                            IsInShoppingCartModel, Recipes, ShoppingListItem,
+                            Tags)
+from recipes.counters import change_recipe_counters, change_user_counters
+from recipes.feed import (FEED_ORDERING, Timeline, backfill_feed, clean_feed,
+                          restore_fan_out)
+from recipes.pantry import pantry_index
+from recipes.relations import link, unlink
+from recipes.shopping_list import change_shopping_list, uncart_recipe
+from recipes.similar import schedule_similar_update
+from recipes.versions import INGREDIENTS, TAGS, get_version
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import (SAFE_METHODS, IsAdminUser,
+                                        IsAuthenticated)
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from users.models import Follow, User
 
-from .filters import NameSearchFilter, RecipeFilter
+from .authentication import token_cache_stats
+from .filters import RecipeFilter
+from .ingredient_index import ingredient_index
 from .pagination import CustomPagination
 from .permissions import IsAdminOrReadOnly, IsAuthorOrReadOnly
-from .serializers import (FollowSerializer, IngredientSerializer,
+from .profiling import slow_requests, timed
+from .renderers import CSVRenderer, JSONStreamRenderer, PlainTextRenderer
+from .serializers import (RECIPE_ROW_FIELDS, BulkIdsSerializer,
+                          FollowSerializer, IngredientSerializer,
                           MyUserSerializer, RecipeReadSerializer,
                           RecipeSerializer, ShortRecipeSerializer,
-                          TagsSerializer)
+                          TagsSerializer, get_recipes_limit,
+                          serialize_recipe_rows)
+from .user_state import (FAVORITE, FOLLOW, SHOPPING_CART, get_user_state,
+                         invalidate_user_state)
+
+
+# Столько лучших рецептов «что приготовить» проверяется фильтрами
+# одним запросом, прежде чем читать все id, прошедшие фильтры.
+COOK_CANDIDATES = 100
+
+# Итог по каждому id в ответах массовых эндпоинтов.
+ADDED = 'added'
+EXISTS = 'exists'
+DELETED = 'deleted'
+ABSENT = 'absent'
+NOT_FOUND = 'not_found'
+SELF = 'self'
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def shopping_cart_txt(ingredients):
+    for ingredient in ingredients:
+        yield (f'•  {ingredient["ingredient__name"]}'
+               f'({ingredient["ingredient__measurement_unit"]})'
+               f'— {ingredient["amount"]}\n')
+
+
+def shopping_cart_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for ingredient in ingredients:
+        yield writer.writerow((ingredient['ingredient__name'],
+                               ingredient['ingredient__measurement_unit'],
+                               ingredient['amount']))
+
+
+def shopping_cart_json(ingredients):
+    separator = '['
+    for ingredient in ingredients:
+        yield separator + json.dumps(
+            {'name': ingredient['ingredient__name'],
+             'measurement_unit': ingredient['ingredient__measurement_unit'],
+             'amount': ingredient['amount']},
+            ensure_ascii=False)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+SHOPPING_CART_FORMATS = {
+    'txt': shopping_cart_txt,
+    'csv': shopping_cart_csv,
+    'json': shopping_cart_json,
+}
+
+
+def get_ingredient_ids(request):
+    try:
+        ids = {int(value)
+               for value in request.query_params.getlist('ingredients')}
+    except ValueError:
+        raise ValidationError({'ingredients': 'Ожидаются id ингредиентов.'})
+    if not ids:
+        raise ValidationError({'ingredients': 'Укажите ингредиенты.'})
+    return ids
+
+
+def get_bulk_ids(request):
+    serializer = BulkIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data['ids']
+
+
+def bulk_outcome(pk, found, changed, skipped, done, kept):
+    if pk not in found:
+        return NOT_FOUND
+    if pk in skipped:
+        return SELF
+    return done if pk in changed else kept
+
+
+def bulk_response(request, ids, found, changed, skipped=()):
+    """Итог по каждому id: не найден, изменён, пропущен или уже был
+    в нужном состоянии. ``changed`` — id, которые вернула сама запись
+    в базу, а не предварительная проверка."""
+    done, kept = ((ADDED, EXISTS) if request.method == 'POST'
+                  else (DELETED, ABSENT))
+    return Response([
+        {'id': pk,
+         'status': bulk_outcome(pk, found, changed, skipped, done, kept)}
+        for pk in ids])
+
+
+def catalog_etag(name):
+    def etag(request, *args, **kwargs):
+        return get_version(name)
+    return etag
+
+
+def recipe_state(request, pk):
+    if not hasattr(request, 'recipe_state'):
+        request.recipe_state = Recipes.objects.filter(pk=pk).values_list(
+            'id', 'author_id', 'updated', 'favorites_count').first()
+    return request.recipe_state
+
+
+def recipe_etag(request, pk):
+    state = recipe_state(request, pk)
+    if state is None:
+        return None
+    recipe_id, author_id, updated, favorites_count = state
+    user_state = get_user_state(request)
+    flags = (recipe_id in user_state[FAVORITE],
+             recipe_id in user_state[SHOPPING_CART],
+             author_id in user_state[FOLLOW])
+    return '-'.join([str(updated.timestamp()), str(favorites_count),
+                     ''.join(str(int(flag)) for flag in flags),
+                     get_version(TAGS), get_version(INGREDIENTS)])
+
+
+def recipe_last_modified(request, pk):
+    if request.user.is_authenticated:
+        return None
+    state = recipe_state(request, pk)
+    return state and state[2]
 
 
 class MyUserViewSet(views.UserViewSet):
     queryset = User.objects.all()
     serializer_class = MyUserSerializer
     pagination_class = CustomPagination
+    keyset_ordering = ('id',)
+
+    def get_subscription_recipes(self):
+        recipes = Recipes.objects.only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time', 'author')
+        limit = get_recipes_limit(self.request)
+        if limit is not None:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipes.objects.filter(
+                    author=OuterRef('author')).values('pk')[:limit]))
+        return recipes
+
+    def get_subscriptions_queryset(self):
+        return User.objects.filter(
+            following__user=self.request.user).prefetch_related(
+            Prefetch('recipes',
+                     queryset=self.get_subscription_recipes())).order_by('id')
 
     @action(detail=False,
             methods=['get'],
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
-        user = request.user
-        queryset = User.objects.filter(following__user=user)
+        queryset = self.get_subscriptions_queryset()
         page = self.paginate_queryset(queryset)
         serializer = FollowSerializer(page,
                                       many=True,
                                       context={'request': request})
         return self.get_paginated_response(serializer.data)
 
+    def follow(self, author_ids):
+        """Подписывает одним INSERT; счётчики и ленты меняются только
+        для действительно созданных подписок, их id и возвращаются."""
+        user = self.request.user
+        with transaction.atomic():
+            added = link(Follow, 'author', user.id, author_ids)
+            if added:
+                change_user_counters(added, 'followers_count', 1)
+                backfill_feed(user.id, added)
+        if added:
+            invalidate_user_state(user.id)
+        return added
+
+    def unfollow(self, author_ids):
+        """Отписывает одним DELETE, возвращает id удалённых подписок."""
+        user = self.request.user
+        with transaction.atomic():
+            deleted = unlink(Follow, 'author', user.id, author_ids)
+            if deleted:
+                change_user_counters(deleted, 'followers_count', -1)
+                restore_fan_out(deleted)
+                clean_feed(user.id, deleted)
+        if deleted:
+            invalidate_user_state(user.id)
+        return deleted
+
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
     def subscribe(self, request, id):
-        user = request.user
-        author = get_object_or_404(User, id=id)
-
         if request.method == 'POST':
-            if user.id == author.id:
+            author = get_object_or_404(User, id=id)
+            if author.id == request.user.id:
                 return Response({'detail': 'Нельзя подписаться на себя'},
                                 status=status.HTTP_400_BAD_REQUEST)
-            if Follow.objects.filter(author=author, user=user).exists():
+            if not self.follow([author.id]):
                 return Response({'detail': 'Вы уже подписаны!'},
                                 status=status.HTTP_400_BAD_REQUEST)
-            Follow.objects.create(user=user, author=author)
             serializer = FollowSerializer(author,
                                           context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            if not Follow.objects.filter(user=user, author=author).exists():
+            if not self.unfollow([int(id)]):
+                get_object_or_404(User.objects.only('id'), id=id)
                 return Response({'errors': 'Вы не подписаны'},
                                 status=status.HTTP_400_BAD_REQUEST)
-            subscription = get_object_or_404(Follow,
-                                             user=user,
-                                             author=author)
-            subscription.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='subscribe',
+            url_name='subscribe-bulk')
+    def subscribe_bulk(self, request):
+        ids = get_bulk_ids(request)
+        found = set(User.objects.filter(id__in=ids).values_list(
+            'id', flat=True))
+        skipped = {request.user.id}
+        wanted = [pk for pk in ids if pk in found and pk not in skipped]
+        if request.method == 'POST':
+            changed = self.follow(wanted)
+        else:
+            changed = self.unfollow(wanted)
+        return bulk_response(request, ids, found, set(changed), skipped)
 
+
+@method_decorator(condition(etag_func=catalog_etag(INGREDIENTS)),
+                  name='list')
+@method_decorator(condition(etag_func=catalog_etag(INGREDIENTS)),
+                  name='retrieve')
 class IngridientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAdminOrReadOnly,)
-    filter_backends = (NameSearchFilter,)
-    search_fields = ('^name',)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return Response(
+            ingredient_index.search(request.query_params.get('name', '')))
+
 
+@method_decorator(condition(etag_func=catalog_etag(TAGS)), name='list')
+@method_decorator(condition(etag_func=catalog_etag(TAGS)), name='retrieve')
 class TagsViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Tags.objects.all()
     serializer_class = TagsSerializer
@@ -84,14 +295,48 @@ class TagsViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
 
 
+RECIPE_COUNTERS = {
+    IsFavorite: 'favorites_count',
+    IsInShoppingCartModel: 'in_carts_count',
+}
+
+
 class AddAndDeleteRecipeView(APIView):
-    def add_recipe(self, model, request, pk):
-        recipe = get_object_or_404(Recipes, pk=pk)
+    def recipes_changed(self, model, recipe_ids, sign):
+        change_recipe_counters(recipe_ids, RECIPE_COUNTERS[model], sign)
+        if model is IsInShoppingCartModel:
+            change_shopping_list(self.request.user.id, recipe_ids, sign)
+
+    def link_recipes(self, model, recipe_ids):
+        """Добавляет рецепты одним INSERT; счётчики и список покупок
+        меняются только для действительно добавленных, их id и
+        возвращаются."""
+        user = self.request.user
+        with transaction.atomic():
+            added = link(model, 'recipe', user.id, recipe_ids)
+            if added:
+                self.recipes_changed(model, added, 1)
+        if added:
+            invalidate_user_state(user.id)
+        return added
+
+    def unlink_recipes(self, model, recipe_ids):
+        """Убирает рецепты одним DELETE, возвращает id удалённых."""
         user = self.request.user
-        if model.objects.filter(recipe=recipe, user=user).exists():
+        with transaction.atomic():
+            deleted = unlink(model, 'recipe', user.id, recipe_ids)
+            if deleted:
+                self.recipes_changed(model, deleted, -1)
+        if deleted:
+            invalidate_user_state(user.id)
+        return deleted
+
+    def add_recipe(self, model, request, pk):
+        recipe = get_object_or_404(Recipes.objects.only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time'), pk=pk)
+        if not self.link_recipes(model, [recipe.id]):
             return Response({'errors': 'Рецепт уже добавлен'},
                             status=status.HTTP_400_BAD_REQUEST)
-        model.objects.create(recipe=recipe, user=user)
         serializer = ShortRecipeSerializer(
             recipe,
             context={'request': request}
@@ -99,21 +344,31 @@ class AddAndDeleteRecipeView(APIView):
         return Response(data=serializer.data, status=status.HTTP_201_CREATED)
 
     def del_recipe(self, model, request, pk):
-        recipe = get_object_or_404(Recipes, pk=pk)
-        user = self.request.user
-        if not model.objects.filter(user=user, recipe=recipe).exists():
+        if not self.unlink_recipes(model, [int(pk)]):
+            get_object_or_404(Recipes.objects.only('id'), pk=pk)
             return Response({'errors': 'Рецепт отсутствует'},
                             status=status.HTTP_400_BAD_REQUEST)
-        obj = get_object_or_404(model, recipe=recipe, user=user)
-        obj.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def bulk_recipes(self, model, request):
+        ids = get_bulk_ids(request)
+        found = set(Recipes.objects.filter(id__in=ids).values_list(
+            'id', flat=True))
+        wanted = [pk for pk in ids if pk in found]
+        if request.method == 'POST':
+            changed = self.link_recipes(model, wanted)
+        else:
+            changed = self.unlink_recipes(model, wanted)
+        return bulk_response(request, ids, found, set(changed))
+
 
 class RecipeViewSet(viewsets.ModelViewSet,
                     AddAndDeleteRecipeView):
     queryset = Recipes.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = (IsAuthorOrReadOnly,)
+    pagination_class = CustomPagination
+    keyset_ordering = ('-pub_date', '-id')
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     http_method_names = [
@@ -121,11 +376,99 @@ class RecipeViewSet(viewsets.ModelViewSet,
         if method not in ['put']
     ]
 
+    def get_queryset(self):
+        return Recipes.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch('amount',
+                     queryset=AmountIngredients.objects.select_related(
+                         'ingredient')))
+
+    @method_decorator(condition(etag_func=recipe_etag,
+                                last_modified_func=recipe_last_modified))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeReadSerializer
         return RecipeSerializer
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(
+            Recipes.objects.values(*RECIPE_ROW_FIELDS))
+        page = self.paginate_queryset(queryset)
+        with timed('serializer'):
+            data = serialize_recipe_rows(
+                list(queryset) if page is None else page, request)
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    @action(detail=False,
+            methods=['get'],
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        self.keyset_ordering = FEED_ORDERING
+        page = self.paginate_queryset(Timeline.for_user(request.user.id))
+        ids = [row['recipe_id'] for row in page]
+        rows = {row['id']: row for row in Recipes.objects.filter(
+            id__in=ids).values(*RECIPE_ROW_FIELDS)}
+        with timed('serializer'):
+            data = serialize_recipe_rows(
+                [rows[pk] for pk in ids if pk in rows], request)
+        return self.get_paginated_response(data)
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk):
+        queryset = Recipes.objects.filter(similar_to__recipe_id=pk).order_by(
+            '-similar_to__score', 'id')
+        limit = get_recipes_limit(request)
+        recipes = list(queryset if limit is None else queryset[:limit])
+        if not recipes:
+            get_object_or_404(Recipes.objects.only('id'), pk=pk)
+        serializer = ShortRecipeSerializer(recipes, many=True,
+                                           context={'request': request})
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def cook(self, request):
+        ingredient_ids = get_ingredient_ids(request)
+        limit = self.paginator.get_page_size(request)
+        queryset = self.filter_queryset(
+            Recipes.objects.values(*RECIPE_ROW_FIELDS))
+        candidates = max(limit, COOK_CANDIDATES)
+        matches = pantry_index.search(ingredient_ids, candidates)
+        rows = {row['id']: row for row in queryset.filter(
+            id__in=[recipe_id for recipe_id, *_ in matches])}
+        if len(rows) < limit and len(matches) == candidates:
+            allowed = set(queryset.values_list('id', flat=True))
+            matches = pantry_index.search(ingredient_ids, limit, allowed)
+            rows = {row['id']: row for row in queryset.filter(
+                id__in=[recipe_id for recipe_id, *_ in matches])}
+        matches = [match for match in matches if match[0] in rows][:limit]
+        with timed('serializer'):
+            data = serialize_recipe_rows(
+                [rows[recipe_id] for recipe_id, *_ in matches], request)
+            for recipe, (_, coverage, missing) in zip(data, matches):
+                recipe['coverage'] = round(coverage, 4)
+                recipe['missing_ingredients'] = ingredient_index.find(
+                    missing)
+        return Response(data)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        Recipes.objects.filter(similar__similar_id=instance.id).update(
+            similar_updated=None)
+        uncart_recipe(instance.id)
+        instance.delete()
+        schedule_similar_update()
+
+    def get_shopping_cart_queryset(self):
+        return ShoppingListItem.objects.filter(
+            user=self.request.user).values(
+            'ingredient__name', 'ingredient__measurement_unit',
+            'amount').order_by('ingredient__name')
+
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
@@ -146,20 +489,52 @@ class RecipeViewSet(viewsets.ModelViewSet,
             return self.del_recipe(IsInShoppingCartModel, request, pk)
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='favorite',
+            url_name='favorite-bulk')
+    def favorite_bulk(self, request):
+        return self.bulk_recipes(IsFavorite, request)
+
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='shopping_cart',
+            url_name='shopping-cart-bulk')
+    def shopping_cart_bulk(self, request):
+        return self.bulk_recipes(IsInShoppingCartModel, request)
+
     @action(detail=False,
             methods=['get'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=[PlainTextRenderer, CSVRenderer,
+                              JSONStreamRenderer])
     def download_shopping_cart(self, request):
-        ingredients = AmountIngredients.objects.filter(
-            recipe__shopping_cart__user=request.user).values(
-            'ingredient__name', 'ingredient__measurement_unit').annotate(
-            amount=Sum('amount'))
-        text = ''
-        for ingredient in ingredients:
-            text += (f'•  {ingredient["ingredient__name"]}'
-                     f'({ingredient["ingredient__measurement_unit"]})'
-                     f'— {ingredient["amount"]}\n')
+        # Строки читаются до ответа: под ASGI Django 3.2 перебирает
+        # потоковый ответ в цикле событий, где ORM недоступен. Строк не
+        # больше, чем ингредиентов в каталоге.
+        ingredients = list(self.get_shopping_cart_queryset())
+        renderer = request.accepted_renderer
+        content = SHOPPING_CART_FORMATS[renderer.format](ingredients)
         headers = {
-            'Content-Disposition': 'attchment; filename=shoping_cart.txt'}
-        return HttpResponse(
-            text, content_type='text/plain; charset=UTF-8', headers=headers)
+            'Content-Disposition':
+                f'attachment; filename=shopping_cart.{renderer.format}'}
+        return StreamingHttpResponse(
+            content,
+            content_type=f'{renderer.media_type}; charset=UTF-8',
+            headers=headers)
+
+
+class SlowRequestsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(slow_requests.slowest())
+
+
+class TokenCacheStatsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(token_cache_stats.as_dict())
@@ -36,6 +36,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.profiling.ProfilingMiddleware',
+    'api.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -45,7 +47,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'foodgram.urls'
+# foodgram.urls_async выставляет foodgram/asgi.py
+ROOT_URLCONF = os.getenv("ROOT_URLCONF", default="foodgram.urls")
 
 TEMPLATES = [
     {
@@ -76,6 +79,30 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения: хосты Postgres или, для SQLite, пути к файлам
+# через запятую. См. api/replicas.py.
+DATABASE_REPLICAS = []
+for number, location in enumerate(
+        filter(None, os.getenv("DB_REPLICAS", default="").split(",")), 1):
+    alias = f'replica{number}'
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if replica['ENGINE'] == 'django.db.backends.sqlite3':
+        replica['NAME'] = location.strip()
+    else:
+        replica['HOST'] = location.strip()
+    DATABASES[alias] = replica
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+# Сколько секунд после изменения данных пользователь читает с основной базы
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", default=10))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': os.getenv("CACHE_LOCATION", default=""),
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -111,7 +138,11 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
@@ -124,6 +155,42 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Авторы с таким числом подписчиков не раскладывают рецепты по лентам,
+# подписчики читают их при запросе ленты, см. recipes/feed.py
+FEED_FANOUT_THRESHOLD = int(os.getenv("FEED_FANOUT_THRESHOLD",
+                                      default=1000))
+
+# thread | queue | sync, см. recipes/similar.py
+SIMILAR_PROCESSING = os.getenv("SIMILAR_PROCESSING", default="thread")
+SIMILAR_RECIPES_COUNT = int(os.getenv("SIMILAR_RECIPES_COUNT", default=10))
+# Доля совпадения тегов в оценке сходства, остальное — ингредиенты
+SIMILAR_TAG_WEIGHT = float(os.getenv("SIMILAR_TAG_WEIGHT", default=0.2))
+
+# Запас в секундах при дочитывании изменённых рецептов в индекс
+# «что приготовить», см. recipes/pantry.py
+COOK_INDEX_LAG = int(os.getenv("COOK_INDEX_LAG", default=30))
+
+# Время жизни кеша токенов, см. api/authentication.py. Запись в кеше
+# памяти процесса не сбросить из других процессов, поэтому без общего
+# кеша (CACHE_BACKEND) кеш токенов по умолчанию выключен.
+LOCAL_CACHE = CACHES['default']['BACKEND'].endswith('.LocMemCache')
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv("AUTH_TOKEN_CACHE_TIMEOUT",
+                                         default=0 if LOCAL_CACHE else 60))
+
+# Сколько секунд версия каталога берётся из кеша, см. recipes/versions.py.
+# Общий кеш сбрасывается при изменении сразу, кеш в памяти процесса —
+# только в изменившем каталог процессе, остальные ждут истечения срока.
+CATALOG_VERSION_TIMEOUT = int(os.getenv("CATALOG_VERSION_TIMEOUT",
+                                        default=5 if LOCAL_CACHE else 300))
+
+# Server-Timing и буфер медленных запросов, см. api/profiling.py
+PROFILING = os.getenv("PROFILING", default="False") == "True"
+PROFILING_SLOW_MS = int(os.getenv("PROFILING_SLOW_MS", default=200))
+PROFILING_BUFFER_SIZE = int(os.getenv("PROFILING_BUFFER_SIZE", default=50))
+
+# thread | queue | sync, см. recipes/images.py
+IMAGE_PROCESSING = os.getenv("IMAGE_PROCESSING", default="thread")
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 DJOSER = {
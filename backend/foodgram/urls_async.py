@@ -0,0 +1,8 @@
+from django.urls import include, path
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/', include('api.urls_async', namespace='api')),
+] + [pattern for pattern in sync_urlpatterns
+     if getattr(pattern, 'namespace', None) != 'api']
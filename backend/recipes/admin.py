@@ -3,9 +3,16 @@ from django.contrib import admin
 from .models import (AmountIngredients, Ingredient, IsFavorite,
                      IsInShoppingCartModel, Recipes, Tags)
 
+
+class RecipesAdmin(admin.ModelAdmin):
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count')
+    list_select_related = ('author',)
+    readonly_fields = ('favorites_count', 'in_carts_count')
+
+
 admin.site.register(Ingredient)
 admin.site.register(AmountIngredients)
-admin.site.register(Recipes)
+admin.site.register(Recipes, RecipesAdmin)
 admin.site.register(Tags)
 admin.site.register(IsInShoppingCartModel)
 admin.site.register(IsFavorite)
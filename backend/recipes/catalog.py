@@ -0,0 +1,220 @@
+import csv
+import io
+import json
+import re
+import time
+from collections import namedtuple
+from itertools import islice
+from operator import itemgetter
+
+from django.db import connection, transaction
+
+from .models import Ingredient, Tags
+from .versions import INGREDIENTS, TAGS, bump_version
+
+BATCH_SIZE = 5000
+JSON_CHUNK_SIZE = 1 << 16
+JSON_SEPARATORS = re.compile(r'[\s,\[\]]*')
+STAGING_TABLE = 'catalog_staging'
+
+Catalog = namedtuple('Catalog', ('model', 'key', 'fields'))
+
+# Поля перечислены в порядке колонок CSV, key — естественный ключ.
+CATALOGS = {
+    INGREDIENTS: Catalog(Ingredient, ('name', 'measurement_unit'),
+                         ('name', 'measurement_unit')),
+    TAGS: Catalog(Tags, ('slug',), ('name', 'color', 'slug')),
+}
+
+
+def read_csv(file, fields):
+    for row in csv.reader(file):
+        if row == list(fields):
+            continue
+        yield dict(zip(fields, row))
+
+
+def read_json(file):
+    """Объекты из JSON-массива или JSON Lines без чтения файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        buffer += chunk
+        position = 0
+        while True:
+            position = JSON_SEPARATORS.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                break
+            yield item
+        buffer = buffer[position:]
+        if not chunk:
+            return
+
+
+def clean_rows(items, catalog):
+    """Кортежи значений в порядке ``catalog.fields``; None вместо строк,
+    которые не пройдут ограничения таблицы."""
+    rules = [(field, catalog.model._meta.get_field(field))
+             for field in catalog.fields]
+    rules = [(field, model_field.null, model_field.max_length)
+             for field, model_field in rules]
+    for item in items:
+        if not isinstance(item, dict):
+            yield None
+            continue
+        row = []
+        for field, null, max_length in rules:
+            value = str(item.get(field) or '').strip() or None
+            if (value is None and not null
+                    or value is not None and len(value) > max_length):
+                row = None
+                break
+            row.append(value)
+        yield row and tuple(row)
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class BatchLoader:
+    """Upsert пачками: один SELECT существующих ключей, новые строки
+    одним ``executemany`` без создания объектов модели."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.created = self.updated = 0
+        self.key = itemgetter(*(catalog.fields.index(field)
+                                for field in catalog.key))
+
+    def load(self, batch):
+        model, key, fields = self.catalog
+        rows = {self.key(row): row for row in batch}
+        existing = {
+            self.key(values[1:]): values
+            for values in model.objects.filter(**{
+                f'{key[0]}__in': {row[fields.index(key[0])]
+                                  for row in batch}
+            }).values_list('pk', *fields)
+        }
+        changed, new = [], []
+        for row_key, row in rows.items():
+            if row_key not in existing:
+                new.append(row)
+            elif existing[row_key][1:] != row:
+                changed.append(model(pk=existing[row_key][0],
+                                     **dict(zip(fields, row))))
+        if new:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {model._meta.db_table} '
+                    f'({", ".join(fields)}) '
+                    f'VALUES ({", ".join(["%s"] * len(fields))})', new)
+        update_fields = [field for field in fields if field not in key]
+        if changed and update_fields:
+            model.objects.bulk_update(changed, update_fields)
+        self.created += len(new)
+        self.updated += len(changed)
+
+    def finish(self):
+        pass
+
+
+class CopyLoader:
+    """Postgres: пачки идут через ``COPY`` во временную таблицу,
+    в конце один ``INSERT ... ON CONFLICT`` переносит их в каталог."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.created = self.updated = 0
+        self.cursor = connection.cursor()
+        columns = ', '.join(f'{field} text' for field in catalog.fields)
+        self.cursor.execute(
+            f'CREATE TEMP TABLE {STAGING_TABLE} '
+            f'(ordinal bigserial, {columns}) ON COMMIT DROP')
+
+    def load(self, batch):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        self.cursor.copy_expert(
+            f'COPY {STAGING_TABLE} ({", ".join(self.catalog.fields)}) '
+            f'FROM STDIN WITH (FORMAT csv)', buffer)
+
+    def finish(self):
+        model, key, fields = self.catalog
+        table = model._meta.db_table
+        columns = ', '.join(fields)
+        key_columns = ', '.join(key)
+        update_fields = [field for field in fields if field not in key]
+        if update_fields:
+            current = ', '.join(f'{table}.{field}'
+                                for field in update_fields)
+            incoming = ', '.join(f'EXCLUDED.{field}'
+                                 for field in update_fields)
+            conflict = (
+                'DO UPDATE SET '
+                + ', '.join(f'{field} = EXCLUDED.{field}'
+                            for field in update_fields)
+                + f' WHERE ({current}) IS DISTINCT FROM ({incoming})')
+        else:
+            conflict = 'DO NOTHING'
+        self.cursor.execute(
+            f'INSERT INTO {table} ({columns}) '
+            f'SELECT DISTINCT ON ({key_columns}) {columns} '
+            f'FROM {STAGING_TABLE} '
+            f'ORDER BY {key_columns}, ordinal DESC '
+            f'ON CONFLICT ({key_columns}) {conflict} '
+            f'RETURNING xmax = 0')
+        for (inserted,) in self.cursor.fetchall():
+            if inserted:
+                self.created += 1
+            else:
+                self.updated += 1
+        self.cursor.close()
+
+
+def load_catalog(name, file, file_format, batch_size=BATCH_SIZE,
+                 use_copy=None, progress=None):
+    """Загружает справочник пачками с upsert по естественному ключу.
+
+    Загрузка и смена версии справочника идут в одной транзакции, кэши
+    версии сбрасываются после коммита, так что кэши и индекс ингредиентов
+    перечитываются уже с новыми данными во всех процессах.
+    """
+    catalog = CATALOGS[name]
+    if use_copy is None:
+        use_copy = connection.vendor == 'postgresql'
+    if file_format == 'json':
+        items = read_json(file)
+    else:
+        items = read_csv(file, catalog.fields)
+    stats = {'rows': 0, 'skipped': 0}
+    start = time.perf_counter()
+    with transaction.atomic():
+        loader = (CopyLoader if use_copy else BatchLoader)(catalog)
+        for batch in batches(clean_rows(items, catalog), batch_size):
+            rows = [row for row in batch if row]
+            stats['skipped'] += len(batch) - len(rows)
+            stats['rows'] += len(batch)
+            if rows:
+                loader.load(rows)
+            if progress:
+                progress(stats['rows'], time.perf_counter() - start)
+        loader.finish()
+        bump_version(name)
+    stats.update(created=loader.created, updated=loader.updated,
+                 seconds=time.perf_counter() - start)
+    return stats
@@ -0,0 +1,55 @@
+from django.apps import apps as global_apps
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+# (модель, поле счётчика, модель связей, поле связи с моделью)
+COUNTERS = (
+    ('recipes.Recipes', 'favorites_count', 'recipes.IsFavorite', 'recipe'),
+    ('recipes.Recipes', 'in_carts_count', 'recipes.IsInShoppingCartModel',
+     'recipe'),
+    ('users.User', 'recipes_count', 'recipes.Recipes', 'author'),
+    ('users.User', 'followers_count', 'users.Follow', 'author'),
+)
+
+
+def counter_value(field, delta):
+    value = F(field) + delta
+    if delta < 0:
+        value = Greatest(value, 0)
+    return value
+
+
+def change_recipe_counters(recipe_ids, field, delta):
+    """Меняет счётчик рецептов одним UPDATE.
+
+    ``updated`` не трогается: он отмечает изменение самого рецепта, по
+    нему индексы дочитывают рецепты, а ETag учитывает счётчик отдельно.
+    """
+    model = global_apps.get_model('recipes.Recipes')
+    return model.objects.filter(pk__in=recipe_ids).update(
+        **{field: counter_value(field, delta)})
+
+
+def change_user_counter(user_id, field, delta):
+    return change_user_counters([user_id], field, delta)
+
+
+def change_user_counters(user_ids, field, delta):
+    model = global_apps.get_model('users.User')
+    return model.objects.filter(pk__in=user_ids).update(
+        **{field: counter_value(field, delta)})
+
+
+def recount(apps=global_apps):
+    """Пересчитывает все счётчики, возвращает число исправленных строк."""
+    fixed = {}
+    for label, field, related_label, related_field in COUNTERS:
+        model = apps.get_model(label)
+        related = apps.get_model(related_label)
+        actual = Coalesce(Subquery(
+            related.objects.filter(**{related_field: OuterRef('pk')})
+            .order_by().values(related_field)
+            .annotate(count=Count('pk')).values('count')), 0)
+        fixed[f'{label}.{field}'] = model.objects.exclude(
+            **{field: actual}).update(**{field: actual})
+    return fixed
@@ -0,0 +1,160 @@
+import heapq
+from operator import itemgetter
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+
+# Порядок ленты: новые рецепты первыми, recipe_id различает рецепты
+# с одинаковой датой.
+FEED_ORDERING = ('-pub_date', '-recipe_id')
+FEED_FIELDS = ('recipe_id', 'pub_date')
+
+
+def tables(apps=global_apps):
+    return {
+        'feed': apps.get_model('recipes.FeedEntry')._meta.db_table,
+        'recipes': apps.get_model('recipes.Recipes')._meta.db_table,
+        'follow': apps.get_model('users.Follow')._meta.db_table,
+        'user': apps.get_model('users.User')._meta.db_table,
+    }
+
+
+def fan_out_recipe(recipe):
+    """Добавляет новый рецепт в ленты подписчиков автора одним INSERT.
+
+    Рецепты авторов с ``FEED_FANOUT_THRESHOLD`` и более подписчиков не
+    раскладываются: подписчики читают их прямо из рецептов.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {feed} (user_id, recipe_id, author_id, pub_date) '
+            'SELECT {follow}.user_id, {recipes}.id, {recipes}.author_id, '
+            '{recipes}.pub_date FROM {follow} '
+            'JOIN {recipes} ON {recipes}.author_id = {follow}.author_id '
+            'JOIN {user} ON {user}.id = {recipes}.author_id '
+            'WHERE {recipes}.id = %s AND {user}.followers_count < %s '
+            'ON CONFLICT DO NOTHING'.format(**tables()),
+            (recipe.id, settings.FEED_FANOUT_THRESHOLD))
+
+
+def backfill_feed(user_id, author_ids):
+    """Рецепты авторов в ленте нового подписчика. Вызывается после
+    увеличения счётчика подписчиков: популярные авторы пропускаются."""
+    names = tables()
+    placeholders = ', '.join(['%s'] * len(author_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {feed} (user_id, recipe_id, author_id, pub_date) '
+            'SELECT %s, {recipes}.id, {recipes}.author_id, '
+            '{recipes}.pub_date FROM {recipes} '
+            'JOIN {user} ON {user}.id = {recipes}.author_id '
+            'WHERE {recipes}.author_id IN ({placeholders}) '
+            'AND {user}.followers_count < %s '
+            'ON CONFLICT DO NOTHING'.format(placeholders=placeholders,
+                                            **names),
+            (user_id, *author_ids, settings.FEED_FANOUT_THRESHOLD))
+
+
+def restore_fan_out(author_ids):
+    """Рецепты авторов, только что опустившихся ниже
+    ``FEED_FANOUT_THRESHOLD``, в лентах оставшихся подписчиков.
+
+    Вызывается после уменьшения счётчика подписчиков: рецепты,
+    опубликованные, пока автор был популярным, в ленты не раскладывались.
+    Авторы ниже порога на несколько подписчиков пропускаются — их ленты
+    уже полные.
+    """
+    names = tables()
+    placeholders = ', '.join(['%s'] * len(author_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {feed} (user_id, recipe_id, author_id, pub_date) '
+            'SELECT {follow}.user_id, {recipes}.id, {recipes}.author_id, '
+            '{recipes}.pub_date FROM {follow} '
+            'JOIN {recipes} ON {recipes}.author_id = {follow}.author_id '
+            'JOIN {user} ON {user}.id = {follow}.author_id '
+            'WHERE {follow}.author_id IN ({placeholders}) '
+            'AND {user}.followers_count = %s '
+            'ON CONFLICT DO NOTHING'.format(placeholders=placeholders,
+                                            **names),
+            (*author_ids, settings.FEED_FANOUT_THRESHOLD - 1))
+
+
+def clean_feed(user_id, author_ids):
+    global_apps.get_model('recipes.FeedEntry').objects.filter(
+        user_id=user_id, author_id__in=author_ids).delete()
+
+
+def rebuild_feeds(apps=global_apps):
+    """Заполняет ленты заново по подпискам; возвращает число записей.
+
+    Нужна после смены порога или удаления подписок мимо API (админка,
+    удаление пользователей): рецепты автора, опустившегося ниже порога,
+    опубликованные без раскладки, в лентах тогда не появляются сами.
+    """
+    names = tables(apps)
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {feed}'.format(**names))
+        cursor.execute(
+            'INSERT INTO {feed} (user_id, recipe_id, author_id, pub_date) '
+            'SELECT {follow}.user_id, {recipes}.id, {recipes}.author_id, '
+            '{recipes}.pub_date FROM {follow} '
+            'JOIN {recipes} ON {recipes}.author_id = {follow}.author_id '
+            'JOIN {user} ON {user}.id = {follow}.author_id '
+            'WHERE {user}.followers_count < %s'.format(**names),
+            (settings.FEED_FANOUT_THRESHOLD,))
+        return cursor.rowcount
+
+
+class Timeline:
+    """Лента пользователя для пагинатора: записи ``FeedEntry`` и рецепты
+    популярных авторов из подписок, слитые по ``FEED_ORDERING``.
+
+    Каждый источник читается диапазоном своего индекса, срез берёт
+    из каждого не больше ``stop`` строк.
+    """
+    ordered = True
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    @classmethod
+    def for_user(cls, user_id):
+        FeedEntry = global_apps.get_model('recipes.FeedEntry')
+        Follow = global_apps.get_model('users.Follow')
+        Recipes = global_apps.get_model('recipes.Recipes')
+        popular = list(Follow.objects.filter(
+            user_id=user_id,
+            author__followers_count__gte=settings.FEED_FANOUT_THRESHOLD,
+        ).values_list('author_id', flat=True))
+        entries = FeedEntry.objects.filter(user_id=user_id)
+        sources = [entries.exclude(author_id__in=popular) if popular
+                   else entries]
+        if popular:
+            sources.append(Recipes.objects.filter(
+                author_id__in=popular).annotate(recipe_id=F('id')))
+        return cls([source.values(*FEED_FIELDS).order_by(*FEED_ORDERING)
+                    for source in sources])
+
+    def order_by(self, *fields):
+        return Timeline([source.order_by(*fields)
+                         for source in self.sources])
+
+    def filter(self, *args, **kwargs):
+        return Timeline([source.filter(*args, **kwargs)
+                         for source in self.sources])
+
+    def count(self):
+        return sum(source.count() for source in self.sources)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if len(self.sources) == 1:
+            return list(self.sources[0][index])
+        merged = heapq.merge(
+            *(source[:index.stop] for source in self.sources),
+            key=itemgetter('pub_date', 'recipe_id'), reverse=True)
+        return list(merged)[index]
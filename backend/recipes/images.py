@@ -0,0 +1,105 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image
+
+from .models import Recipes
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SIZES = {
+    'small': 320,
+    'medium': 720,
+}
+# API отдаёт только WebP-копии, поэтому другие форматы не создаются.
+VARIANT_FORMAT = 'webp'
+
+executor = ThreadPoolExecutor(max_workers=2,
+                              thread_name_prefix='recipe-images')
+
+
+def build_variants(recipe):
+    """Сохраняет уменьшенные WebP-копии картинки рецепта.
+
+    Возвращает словарь ``{размер: {формат: путь}}``. Копии крупнее
+    оригинала не создаются.
+    """
+    with recipe.image.open('rb') as file:
+        original = Image.open(file)
+        original.load()
+    if original.mode not in ('RGB', 'L'):
+        original = original.convert('RGB')
+    base, _ = os.path.splitext(recipe.image.name)
+    variants = {}
+    for size, width in VARIANT_SIZES.items():
+        if original.width <= width and variants:
+            break
+        image = original.copy()
+        image.thumbnail((width, width * 4))
+        buffer = BytesIO()
+        try:
+            image.save(buffer, VARIANT_FORMAT.upper(), quality=80)
+        except (KeyError, OSError):
+            logger.warning('Формат %s недоступен в Pillow', VARIANT_FORMAT)
+            break
+        name = f'{base}_{size}.{VARIANT_FORMAT}'
+        default_storage.delete(name)
+        variants[size] = {VARIANT_FORMAT: default_storage.save(
+            name, ContentFile(buffer.getvalue()))}
+    return variants
+
+
+def delete_variants(variants):
+    """Удаляет файлы копий после коммита текущей транзакции."""
+    paths = [path for formats in (variants or {}).values()
+             for path in formats.values()]
+    if paths:
+        transaction.on_commit(
+            lambda: [default_storage.delete(path) for path in paths])
+
+
+def process_recipe_image(recipe_id):
+    recipe = Recipes.objects.filter(pk=recipe_id).first()
+    if recipe is None or not recipe.image:
+        return
+    try:
+        variants = build_variants(recipe)
+    except (OSError, ValueError):
+        logger.exception('Не удалось обработать картинку рецепта %s',
+                         recipe_id)
+        variants = {}
+    updated = Recipes.objects.filter(
+        pk=recipe_id, image=recipe.image.name).update(
+        image_variants=variants, updated=timezone.now())
+    if not updated:
+        # Картинку успели заменить — копии старой никому не нужны.
+        delete_variants(variants)
+
+
+def run_in_thread(recipe_id):
+    close_old_connections()
+    try:
+        process_recipe_image(recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_image_processing(recipe):
+    """Ставит обработку картинки после коммита текущей транзакции.
+
+    ``IMAGE_PROCESSING``: ``thread`` — пул потоков в процессе,
+    ``queue`` — команда ``process_images``, ``sync`` — сразу.
+    """
+    mode = settings.IMAGE_PROCESSING
+    if mode == 'thread':
+        transaction.on_commit(
+            lambda: executor.submit(run_in_thread, recipe.pk))
+    elif mode == 'sync':
+        transaction.on_commit(lambda: process_recipe_image(recipe.pk))
@@ -0,0 +1,50 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from recipes.catalog import BATCH_SIZE, CATALOGS, load_catalog
+from recipes.versions import INGREDIENTS, TAGS
+
+DEFAULT_FILES = {
+    INGREDIENTS: settings.BASE_DIR / 'data' / 'ingredients.json',
+    TAGS: settings.BASE_DIR / 'data' / 'tag.csv',
+}
+FORMATS = ('csv', 'json', 'jsonl')
+
+
+class Command(BaseCommand):
+    help = 'Загрузка справочника ингредиентов или тегов из CSV или JSON'
+    catalog = None
+
+    def add_arguments(self, parser):
+        if self.catalog is None:
+            parser.add_argument('catalog', choices=sorted(CATALOGS))
+        parser.add_argument('--path', type=Path)
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Не использовать COPY на Postgres')
+
+    def handle(self, *args, **options):
+        catalog = self.catalog or options['catalog']
+        path = options['path'] or DEFAULT_FILES[catalog]
+        file_format = options['format'] or path.suffix.lstrip('.')
+        if file_format not in FORMATS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        if not path.exists():
+            raise CommandError(f'Файл не найден: {path}')
+        with open(path, encoding='utf-8', newline='') as file:
+            stats = load_catalog(
+                catalog, file,
+                'csv' if file_format == 'csv' else 'json',
+                batch_size=options['batch_size'],
+                use_copy=False if options['no_copy'] else None,
+                progress=self.progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'{path.name}: строк {stats["rows"]}, '
+            f'добавлено {stats["created"]}, обновлено {stats["updated"]}, '
+            f'пропущено {stats["skipped"]} за {stats["seconds"]:.2f} с'))
+
+    def progress(self, rows, seconds):
+        self.stdout.write(f'Прочитано строк: {rows} '
+                          f'({rows / max(seconds, 1e-6):.0f} строк/с)')
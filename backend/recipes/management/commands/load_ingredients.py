@@ -1,25 +1,8 @@
-import csv
+from recipes.versions import INGREDIENTS
 
-from django.core.management.base import BaseCommand
-from recipes.models import Ingredient
+from .load_catalog import Command as LoadCatalogCommand
 
 
-class Command(BaseCommand):
-    help = 'загрузка ингредиентов'
-
-    def handle(self, *args, **options):
-        with open(
-            './data/ingredients.csv', 'r', encoding='utf-8'
-        ) as csv_file:
-            csv_reader = csv.reader(csv_file, delimiter=',')
-            ingredients = []
-            for row in csv_reader:
-                try:
-                    create_ingredients = Ingredient(
-                        name=row[0],
-                        measurement_unit=row[1],
-                    )
-                    ingredients.append(create_ingredients)
-                except ValueError:
-                    print('Неверные данные')
-            Ingredient.objects.bulk_create(ingredients)
+class Command(LoadCatalogCommand):
+    help = 'Загрузка ингредиентов'
+    catalog = INGREDIENTS
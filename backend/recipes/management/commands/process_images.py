@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from recipes.images import process_recipe_image
+from recipes.models import Recipes
+
+
+class Command(BaseCommand):
+    help = 'Обработка очереди картинок рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--interval', type=float, default=5)
+        parser.add_argument('--once', action='store_true')
+
+    def handle(self, *args, **options):
+        while True:
+            pending = list(Recipes.objects.filter(
+                image_variants__isnull=True).exclude(image='').order_by(
+                'pk').values_list('pk', flat=True)[:options['batch_size']])
+            for recipe_id in pending:
+                process_recipe_image(recipe_id)
+            if pending:
+                self.stdout.write(f'Обработано картинок: {len(pending)}')
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.feed import rebuild_feeds
+
+
+class Command(BaseCommand):
+    help = ('Пересборка лент подписок: после смены FEED_FANOUT_THRESHOLD '
+            'или потери автором статуса популярного')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        self.stdout.write(f'Записей в лентах: {rebuild_feeds()}')
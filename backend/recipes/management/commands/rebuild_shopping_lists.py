@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.shopping_list import check_shopping_lists, rebuild_shopping_lists
+
+
+class Command(BaseCommand):
+    help = ('Сверка списков покупок с рецептами в покупках и пересборка '
+            'с нуля')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только сверить, ошибка при расхождениях.')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        mismatched = check_shopping_lists()
+        self.stdout.write(f'Расходящихся строк: {mismatched}')
+        if options['check']:
+            if mismatched:
+                raise CommandError('Списки покупок расходятся с покупками.')
+            return
+        self.stdout.write(f'Строк в списках: {rebuild_shopping_lists()}')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.counters import recount
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт счётчиков избранного, покупок, рецептов и подписчиков'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        for counter, fixed in recount().items():
+            self.stdout.write(f'{counter}: исправлено {fixed}')
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from recipes.similar import process_pending, rebuild_similar
+
+
+class Command(BaseCommand):
+    help = ('Пересчёт похожих рецептов: очередь изменённых рецептов '
+            'или, с --full, все рецепты заново')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--interval', type=float, default=5)
+        parser.add_argument('--once', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['full']:
+            count = rebuild_similar()
+            self.stdout.write(f'Пересчитано рецептов: {count}')
+            return
+        while True:
+            count = process_pending(options['batch_size'])
+            if count:
+                self.stdout.write(f'Пересчитано рецептов: {count}')
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.19 on 2026-10-18 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_recipes_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='image_variants',
+            field=models.JSONField(blank=True, editable=False, null=True, verbose_name='Уменьшенные копии картинки'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from recipes.search import install_search, uninstall_search
+
+
+def forwards(apps, schema_editor):
+    install_search(schema_editor.connection)
+
+
+def backwards(apps, schema_editor):
+    uninstall_search(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+from django.db.models import Count, F, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    AmountIngredients = apps.get_model('recipes', 'AmountIngredients')
+    duplicates = Ingredient.objects.order_by().values(
+        'name', 'measurement_unit').annotate(
+        keep=Min('id'), total=Count('id')).filter(total__gt=1)
+    for group in duplicates:
+        extra = Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit']).exclude(
+            id=group['keep'])
+        kept = dict(AmountIngredients.objects.filter(
+            ingredient_id=group['keep']).values_list('recipe_id', 'id'))
+        for amount in AmountIngredients.objects.filter(
+                ingredient__in=extra).order_by('id'):
+            if amount.recipe_id in kept:
+                # Рецепт уже содержит оставляемый ингредиент: количества
+                # складываются в одну строку.
+                AmountIngredients.objects.filter(
+                    id=kept[amount.recipe_id]).update(
+                    amount=F('amount') + amount.amount)
+                amount.delete()
+                continue
+            amount.ingredient_id = group['keep']
+            amount.save(update_fields=('ingredient',))
+            kept[amount.recipe_id] = amount.id
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+    ]
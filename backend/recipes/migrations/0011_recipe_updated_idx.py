@@ -0,0 +1,17 @@
+# Generated by Django 3.2.19 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_similar_recipes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipes',
+            index=models.Index(fields=['updated'], name='recipe_updated_idx'),
+        ),
+    ]
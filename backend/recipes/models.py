@@ -1,6 +1,6 @@
 from django.core.validators import MinValueValidator
 from django.db import models
-from users.models import User
+from users.models import CountersMixin, User
 
 
 class Ingredient(models.Model):
@@ -17,6 +17,10 @@ class Ingredient(models.Model):
         verbose_name = 'Ингридиент'
         verbose_name_plural = 'Ингридиенты'
         ordering = ('pk',)
+        constraints = (
+            models.UniqueConstraint(fields=('name', 'measurement_unit'),
+                                    name='unique_ingredient'),
+        )
 
     def __str__(self):
         return self.name
@@ -48,7 +52,9 @@ class Tags(models.Model):
         return self.name
 
 
-class Recipes(models.Model):
+class Recipes(CountersMixin, models.Model):
+    counter_fields = ('favorites_count', 'in_carts_count')
+
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -63,6 +69,12 @@ class Recipes(models.Model):
         'Картинка',
         upload_to='uploads/%Y/%m/%d/'
     )
+    image_variants = models.JSONField(
+        'Уменьшенные копии картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
     text = models.TextField(
         'Описание'
     )
@@ -93,11 +105,37 @@ class Recipes(models.Model):
         auto_now_add=True,
         help_text='Дата публикации',
     )
+    updated = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'В списках покупок',
+        default=0,
+        editable=False,
+    )
+    similar_updated = models.DateTimeField(
+        'Похожие рецепты пересчитаны',
+        null=True,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipe_pub_date_idx'),
+            models.Index(fields=('author', '-pub_date'),
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=('updated',), name='recipe_updated_idx'),
+        )
 
     def __str__(self):
         return self.name
@@ -157,6 +195,10 @@ class IsInShoppingCartModel(models.Model):
                 name='unique_is_in_shopping_cart'
             )
         ]
+        indexes = (
+            models.Index(fields=('user', 'recipe'),
+                         name='shopping_cart_user_recipe_idx'),
+        )
 
     def __str__(self):
         return f'Рецепт {self.recipe} в покупках или нет у {self.user}'
@@ -185,6 +227,144 @@ class IsFavorite(models.Model):
                 name='unique_is_favorite'
             )
         ]
+        indexes = (
+            models.Index(fields=('user', 'recipe'),
+                         name='favorite_user_recipe_idx'),
+        )
 
     def __str__(self):
         return f'Рецепт {self.recipe} в избрангом или нет у {self.user}'
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента по рецептам в покупках пользователя,
+    см. recipes/shopping_list.py."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+        related_name='+'
+    )
+    amount = models.IntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списке покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} в списке покупок {self.user}'
+
+
+class FeedEntry(models.Model):
+    """Рецепт автора в ленте подписчика, см. recipes/feed.py."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Подписчик',
+        related_name='feed'
+    )
+    recipe = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='feed_entries'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор',
+        related_name='+'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = (
+            models.Index(fields=('user', '-pub_date', '-recipe'),
+                         name='feed_user_pub_date_idx'),
+        )
+
+    def __str__(self):
+        return f'Рецепт {self.recipe} в ленте {self.user}'
+
+
+class SimilarRecipe(models.Model):
+    """Заранее посчитанные похожие рецепты, см. recipes/similar.py."""
+    recipe = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='similar'
+    )
+    similar = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        verbose_name='Похожий рецепт',
+        related_name='similar_to'
+    )
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='unique_similar_recipe'
+            )
+        ]
+        indexes = (
+            models.Index(fields=('recipe', '-score'),
+                         name='similar_recipe_score_idx'),
+        )
+
+    def __str__(self):
+        return f'{self.similar} похож на {self.recipe}'
+
+
+class DeletedRecipe(models.Model):
+    """Отметка об удалённом рецепте для индексов в памяти процессов,
+    см. recipes/pantry.py."""
+    recipe_id = models.PositiveIntegerField('Рецепт')
+    deleted = models.DateTimeField('Дата удаления', auto_now_add=True,
+                                   db_index=True)
+
+    class Meta:
+        verbose_name = 'Удалённый рецепт'
+        verbose_name_plural = 'Удалённые рецепты'
+
+    def __str__(self):
+        return f'Рецепт {self.recipe_id} удалён {self.deleted}'
+
+
+class CatalogVersion(models.Model):
+    """Версия каталога для кешей в памяти процессов,
+    см. recipes/versions.py."""
+    name = models.CharField('Каталог', max_length=32, primary_key=True)
+    version = models.CharField('Версия', max_length=32)
+
+    class Meta:
+        verbose_name = 'Версия каталога'
+        verbose_name_plural = 'Версии каталогов'
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
@@ -0,0 +1,95 @@
+from collections import defaultdict
+from datetime import timedelta
+from threading import Lock
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import AmountIngredients, DeletedRecipe, Recipes
+from .similar import SetIndex, SparseIndex, np, ranked, sparse
+
+# Сколько хранятся отметки об удалённых рецептах. Индекс, не
+# обновлявшийся дольше, загружается заново.
+TOMBSTONE_TTL = timedelta(days=1)
+
+
+def record_deleted(recipe_id):
+    now = timezone.now()
+    DeletedRecipe.objects.filter(deleted__lt=now - TOMBSTONE_TTL).delete()
+    DeletedRecipe.objects.create(recipe_id=recipe_id, deleted=now)
+
+
+def changed_recipes(since):
+    """Id рецептов, изменённых или удалённых начиная с ``since``."""
+    return Recipes.objects.filter(updated__gte=since).order_by().values_list(
+        'id', flat=True).union(DeletedRecipe.objects.filter(
+            deleted__gte=since).values_list('recipe_id', flat=True), all=True)
+
+
+class PantryIndex:
+    """Обратный индекс ингредиент → рецепты в памяти процесса для поиска
+    «что приготовить» из продуктов в наличии.
+
+    Загружается при первом обращении одним проходом по
+    ``AmountIngredients``. Перед каждым поиском дочитывает рецепты,
+    изменённые после прошлой проверки, с запасом ``COOK_INDEX_LAG``
+    секунд на транзакции, закоммиченные позже своей отметки ``updated``.
+    Удалённые рецепты находятся тем же запросом по ``DeletedRecipe``.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.index = None
+        self.checked = None
+
+    def read(self, amounts, recipe_ids=None):
+        ingredients = defaultdict(set)
+        for recipe_id, ingredient_id in amounts.values_list(
+                'recipe_id', 'ingredient_id').iterator():
+            ingredients[recipe_id].add(ingredient_id)
+        for recipe_id in ingredients if recipe_ids is None else recipe_ids:
+            if ingredients[recipe_id]:
+                self.index.set(recipe_id, ingredients[recipe_id], ())
+            else:
+                self.index.remove(recipe_id)
+
+    def refresh(self):
+        checked = timezone.now()
+        if self.index is None or checked - self.checked > TOMBSTONE_TTL:
+            self.index = SparseIndex() if sparse is not None else SetIndex()
+            self.read(AmountIngredients.objects.all())
+        else:
+            changed = set(changed_recipes(self.checked - timedelta(
+                seconds=settings.COOK_INDEX_LAG)))
+            if changed:
+                self.read(AmountIngredients.objects.filter(
+                    recipe_id__in=changed), changed)
+        self.checked = checked
+
+    def search(self, ingredient_ids, count, allowed=None):
+        """Первые ``count`` рецептов по доле ингредиентов, которые есть
+        в ``ingredient_ids``: список (id, доля, id недостающих).
+
+        ``allowed`` — множество id, которым ограничен поиск.
+        """
+        ingredient_ids = set(ingredient_ids)
+        with self.lock:
+            self.refresh()
+            ids, scores = self.index.coverage(ingredient_ids)
+            if allowed is not None:
+                if np is not None:
+                    keep = np.isin(ids, list(allowed))
+                    ids, scores = ids[keep], scores[keep]
+                else:
+                    keep = [index for index, recipe_id in enumerate(ids)
+                            if recipe_id in allowed]
+                    ids = [ids[index] for index in keep]
+                    scores = [scores[index] for index in keep]
+            return [
+                (recipe_id, score, sorted(
+                    set(self.index.ingredients_of(recipe_id))
+                    - ingredient_ids))
+                for recipe_id, score in ranked(ids, scores, count)]
+
+
+pantry_index = PantryIndex()
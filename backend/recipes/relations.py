@@ -0,0 +1,36 @@
+from django.db import connection
+
+
+def link(model, field, user_id, object_ids):
+    """Создаёт связи пользователя одним INSERT ... ON CONFLICT DO NOTHING.
+
+    Повторы отсекает уникальное ограничение, в том числе при
+    параллельных запросах. Возвращает id объектов, связь с которыми
+    действительно добавлена.
+    """
+    if not object_ids:
+        return []
+    column = model._meta.get_field(field).column
+    values = ', '.join(['(%s, %s)'] * len(object_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {model._meta.db_table} (user_id, {column}) '
+            f'VALUES {values} ON CONFLICT DO NOTHING RETURNING {column}',
+            [param for object_id in object_ids
+             for param in (user_id, object_id)])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def unlink(model, field, user_id, object_ids):
+    """Удаляет связи одним DELETE; возвращает id объектов, связь с
+    которыми действительно была."""
+    if not object_ids:
+        return []
+    column = model._meta.get_field(field).column
+    placeholders = ', '.join(['%s'] * len(object_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {model._meta.db_table} WHERE user_id = %s '
+            f'AND {column} IN ({placeholders}) RETURNING {column}',
+            (user_id, *object_ids))
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,154 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipes_fts'
+
+# Postgres: столбец tsvector поддерживается триггером, поэтому
+# bulk_create и update() тоже попадают в индекс.
+POSTGRES_INSTALL = (
+    'ALTER TABLE recipes_recipes '
+    'ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    f"""
+    CREATE OR REPLACE FUNCTION recipes_search_vector_update()
+    RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}',
+                                  coalesce(NEW.name, '')), 'A')
+            || setweight(to_tsvector('{SEARCH_CONFIG}',
+                                     coalesce(NEW.text, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    'DROP TRIGGER IF EXISTS recipes_search_vector_trigger '
+    'ON recipes_recipes',
+    'CREATE TRIGGER recipes_search_vector_trigger '
+    'BEFORE INSERT OR UPDATE OF name, text ON recipes_recipes '
+    'FOR EACH ROW EXECUTE PROCEDURE recipes_search_vector_update()',
+    'UPDATE recipes_recipes SET name = name WHERE search_vector IS NULL',
+    'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+    'ON recipes_recipes USING gin (search_vector)',
+)
+POSTGRES_UNINSTALL = (
+    'DROP TRIGGER IF EXISTS recipes_search_vector_trigger '
+    'ON recipes_recipes',
+    'DROP FUNCTION IF EXISTS recipes_search_vector_update()',
+    'ALTER TABLE recipes_recipes DROP COLUMN IF EXISTS search_vector',
+)
+
+# SQLite: внешняя FTS5-таблица над recipes_recipes и триггеры синхронизации.
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_insert': f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+    AFTER INSERT ON recipes_recipes BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    f'{FTS_TABLE}_delete': f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+    AFTER DELETE ON recipes_recipes BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    """,
+    f'{FTS_TABLE}_update': f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF name, text ON recipes_recipes BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+}
+SQLITE_UNINSTALL = tuple(
+    f'DROP TRIGGER IF EXISTS {name}' for name in SQLITE_TRIGGERS
+) + (f'DROP TABLE IF EXISTS {FTS_TABLE}',)
+
+
+def install_search(connection):
+    """Создаёт поисковый индекс рецептов, если его ещё нет.
+
+    Повторный вызов безопасен. На SQLite пересборка таблицы в миграциях
+    удаляет триггеры, поэтому там функция вызывается и после каждого
+    ``migrate``: недостающие триггеры создаются, а индекс пересобирается.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRES_INSTALL:
+                cursor.execute(sql)
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+                f"USING fts5(name, text, content='recipes_recipes', "
+                f"content_rowid='id', tokenize='unicode61')")
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+                "AND tbl_name = 'recipes_recipes'")
+            existing = {row[0] for row in cursor.fetchall()}
+            missing = set(SQLITE_TRIGGERS) - existing
+            for name in missing:
+                cursor.execute(SQLITE_TRIGGERS[name])
+            if missing:
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def uninstall_search(connection):
+    statements = {
+        'postgresql': POSTGRES_UNINSTALL,
+        'sqlite': SQLITE_UNINSTALL,
+    }.get(connection.vendor, ())
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def fts_match(query):
+    """Запрос FTS5: все слова обязательны, каждое ищется как префикс."""
+    words = re.findall(r'\w+', query)
+    return ' '.join('"{}"*'.format(word) for word in words)
+
+
+def search_recipes(queryset, query):
+    """Фильтрует рецепты по названию и описанию и сортирует по релевантности.
+
+    Совпадения в названии весят больше, чем в описании. На бэкендах без
+    полнотекстового индекса используется ``icontains``.
+    """
+    query = query.strip()
+    if not query:
+        return queryset
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        queryset = queryset.filter(RawSQL(
+            f'recipes_recipes.search_vector @@ {tsquery}', (query,),
+            output_field=BooleanField(),
+        )).annotate(search_rank=RawSQL(
+            f'ts_rank(recipes_recipes.search_vector, {tsquery})', (query,),
+            output_field=FloatField(),
+        ))
+    elif vendor == 'sqlite':
+        match = fts_match(query)
+        if not match:
+            return queryset.none()
+        queryset = queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (match,),
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s '
+            f'AND {FTS_TABLE}.rowid = recipes_recipes.id',
+            (match,), output_field=FloatField(),
+        ))
+    else:
+        return queryset.filter(Q(name__icontains=query)
+                               | Q(text__icontains=query))
+    return queryset.order_by('-search_rank', '-pub_date', '-id')
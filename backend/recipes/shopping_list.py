@@ -0,0 +1,94 @@
+from django.apps import apps as global_apps
+from django.db import connection
+
+
+def tables(apps=global_apps):
+    return {
+        'items': apps.get_model('recipes.ShoppingListItem')._meta.db_table,
+        'cart': apps.get_model(
+            'recipes.IsInShoppingCartModel')._meta.db_table,
+        'amounts': apps.get_model(
+            'recipes.AmountIngredients')._meta.db_table,
+    }
+
+
+# Количества рецепта прибавляются к строкам списка одним INSERT ... ON
+# CONFLICT; строки, где сумма дошла до нуля, удаляются.
+UPSERT = ('INSERT INTO {items} (user_id, ingredient_id, amount) {select} '
+          'ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+          'SET amount = {items}.amount + excluded.amount')
+EXPECTED = ('SELECT {cart}.user_id, {amounts}.ingredient_id, '
+            'SUM({amounts}.amount) FROM {cart} '
+            'JOIN {amounts} ON {amounts}.recipe_id = {cart}.recipe_id '
+            'GROUP BY {cart}.user_id, {amounts}.ingredient_id')
+ACTUAL = 'SELECT user_id, ingredient_id, amount FROM {items}'
+
+
+def change_shopping_list(user_id, recipe_ids, sign=1):
+    """Прибавляет ингредиенты рецептов к списку покупок пользователя,
+    ``sign=-1`` — вычитает."""
+    names = tables()
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    select = ('SELECT %s, ingredient_id, %s * SUM(amount) FROM {amounts} '
+              'WHERE recipe_id IN ({placeholders}) '
+              'GROUP BY ingredient_id').format(placeholders=placeholders,
+                                               **names)
+    with connection.cursor() as cursor:
+        cursor.execute(UPSERT.format(select=select, **names),
+                       (user_id, sign, *recipe_ids))
+        if sign < 0 and cursor.rowcount:
+            cursor.execute(
+                'DELETE FROM {items} WHERE user_id = %s '
+                'AND amount <= 0'.format(**names), (user_id,))
+
+
+def change_carted_recipe(recipe_id, sign=1):
+    """То же для всех, у кого рецепт в покупках: вызывается до и после
+    изменения ингредиентов рецепта."""
+    names = tables()
+    select = ('SELECT {cart}.user_id, {amounts}.ingredient_id, '
+              '%s * {amounts}.amount FROM {cart} '
+              'JOIN {amounts} ON {amounts}.recipe_id = {cart}.recipe_id '
+              'WHERE {cart}.recipe_id = %s').format(**names)
+    with connection.cursor() as cursor:
+        cursor.execute(UPSERT.format(select=select, **names),
+                       (sign, recipe_id))
+        if sign < 0 and cursor.rowcount:
+            cursor.execute(
+                'DELETE FROM {items} WHERE amount <= 0 AND user_id IN '
+                '(SELECT user_id FROM {cart} WHERE recipe_id = %s)'.format(
+                    **names), (recipe_id,))
+
+
+def uncart_recipe(recipe_id):
+    """Вычитает рецепт из списков и убирает его из покупок перед
+    удалением рецепта: два запроса вместо сигнала на каждую строку."""
+    change_carted_recipe(recipe_id, -1)
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {cart} WHERE recipe_id = %s'.format(
+            **tables()), (recipe_id,))
+
+
+def check_shopping_lists(apps=global_apps):
+    """Число строк, которыми списки расходятся с суммой по покупкам."""
+    names = tables(apps)
+    expected = EXPECTED.format(**names)
+    actual = ACTUAL.format(**names)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT COUNT(*) FROM ({expected} EXCEPT {actual}) expected')
+        missing = cursor.fetchone()[0]
+        cursor.execute(
+            f'SELECT COUNT(*) FROM ({actual} EXCEPT {expected}) actual')
+        return missing + cursor.fetchone()[0]
+
+
+def rebuild_shopping_lists(apps=global_apps):
+    """Заполняет списки заново по покупкам; возвращает число строк."""
+    names = tables(apps)
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {items}'.format(**names))
+        cursor.execute(
+            'INSERT INTO {items} (user_id, ingredient_id, amount) '.format(
+                **names) + EXPECTED.format(**names))
+        return cursor.rowcount
@@ -0,0 +1,62 @@
+from django.db import connections
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .counters import change_recipe_counters, change_user_counter
+from .models import Ingredient, IsInShoppingCartModel, Recipes, Tags
+from .pantry import record_deleted
+from .search import install_search
+from .shopping_list import change_shopping_list
+from .versions import INGREDIENTS, TAGS, bump_version
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredients_changed(**kwargs):
+    bump_version(INGREDIENTS)
+
+
+@receiver((post_save, post_delete), sender=Tags)
+def tags_changed(**kwargs):
+    bump_version(TAGS)
+
+
+@receiver(post_save, sender=Recipes)
+def recipe_saved(instance, created, **kwargs):
+    if created:
+        change_user_counter(instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipes)
+def recipe_deleted(instance, **kwargs):
+    # Сигналы, а не API: рецепт удаляют и из админки, и каскадом.
+    change_user_counter(instance.author_id, 'recipes_count', -1)
+    record_deleted(instance.pk)
+
+
+# API меняет покупки SQL-запросами без сигналов (recipes/relations.py);
+# сигналы ловят изменения мимо API: из админки и каскадные удаления
+# вместе с рецептом или пользователем.
+@receiver(post_save, sender=IsInShoppingCartModel)
+def cart_row_saved(instance, created, **kwargs):
+    if created:
+        change_shopping_list(instance.user_id, [instance.recipe_id])
+        change_recipe_counters([instance.recipe_id], 'in_carts_count', 1)
+
+
+@receiver(pre_delete, sender=IsInShoppingCartModel)
+def cart_row_deleted(instance, **kwargs):
+    # pre_delete: ингредиенты рецепта при каскаде ещё не удалены.
+    change_shopping_list(instance.user_id, [instance.recipe_id], -1)
+    change_recipe_counters([instance.recipe_id], 'in_carts_count', -1)
+
+
+def restore_search_index(using, **kwargs):
+    """Возвращает триггеры поиска, удалённые пересборкой таблицы SQLite.
+
+    На Postgres индекс создаёт миграция 0005, и ALTER TABLE его не трогает.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    if Recipes._meta.db_table in connection.introspection.table_names():
+        install_search(connection)
@@ -0,0 +1,392 @@
+import logging
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .models import AmountIngredients, Recipes, SimilarRecipe
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+CHUNK_SIZE = 500
+
+executor = ThreadPoolExecutor(max_workers=1,
+                              thread_name_prefix='similar-recipes')
+
+
+def similarity(shared, size, other_size, shared_tags, tags, other_tags):
+    """Жаккар по ингредиентам, смешанный с Жаккаром по тегам с весом
+    ``SIMILAR_TAG_WEIGHT``. Работает и с числами, и с массивами NumPy."""
+    weight = settings.SIMILAR_TAG_WEIGHT
+    tag_union = tags + other_tags - shared_tags
+    if np is not None:
+        tag_score = np.divide(shared_tags, tag_union,
+                              out=np.zeros(np.shape(tag_union)),
+                              where=tag_union > 0)
+    else:
+        tag_score = shared_tags / tag_union if tag_union else 0
+    return ((1 - weight) * shared / (size + other_size - shared)
+            + weight * tag_score)
+
+
+def ranked(ids, scores, count):
+    """Первые ``count`` пар (id, оценка): по убыванию оценки, затем по id."""
+    if np is not None:
+        ids, scores = np.asarray(ids), np.asarray(scores)
+        if count is not None and count < len(scores):
+            lowest = -np.partition(-scores, count - 1)[count - 1]
+            keep = scores >= lowest
+            ids, scores = ids[keep], scores[keep]
+        order = np.lexsort((ids, -scores))[:count]
+        return [(int(ids[i]), float(scores[i])) for i in order]
+    return sorted(zip(ids, scores),
+                  key=lambda item: (-item[1], item[0]))[:count]
+
+
+class SetIndex:
+    """Обратный индекс ингредиент → рецепты на множествах Python."""
+
+    def __init__(self):
+        self.ingredients = {}
+        self.tags = {}
+        self.postings = defaultdict(set)
+
+    def __contains__(self, recipe_id):
+        return recipe_id in self.ingredients
+
+    def set(self, recipe_id, ingredients, tags):
+        self.remove(recipe_id)
+        self.ingredients[recipe_id] = frozenset(ingredients)
+        self.tags[recipe_id] = frozenset(tags)
+        for ingredient_id in ingredients:
+            self.postings[ingredient_id].add(recipe_id)
+
+    def remove(self, recipe_id):
+        for ingredient_id in self.ingredients.pop(recipe_id, ()):
+            self.postings[ingredient_id].discard(recipe_id)
+        self.tags.pop(recipe_id, None)
+
+    def ingredients_of(self, recipe_id):
+        return self.ingredients[recipe_id]
+
+    def coverage(self, ingredient_ids):
+        """id рецептов хотя бы с одним из ингредиентов и доля их
+        ингредиентов, которая есть в наборе."""
+        shared = Counter()
+        for ingredient_id in ingredient_ids:
+            shared.update(self.postings.get(ingredient_id, ()))
+        ids = list(shared)
+        return ids, [shared[recipe_id] / len(self.ingredients[recipe_id])
+                     for recipe_id in ids]
+
+    def scores(self, recipe_ids):
+        """Для каждого рецепта — id рецептов с общими ингредиентами
+        и их оценки."""
+        for recipe_id in recipe_ids:
+            own = self.ingredients[recipe_id]
+            own_tags = self.tags[recipe_id]
+            shared = Counter()
+            for ingredient_id in own:
+                shared.update(self.postings[ingredient_id])
+            del shared[recipe_id]
+            ids = list(shared)
+            yield recipe_id, ids, [
+                similarity(shared[other], len(own),
+                           len(self.ingredients[other]),
+                           len(own_tags & self.tags[other]), len(own_tags),
+                           len(self.tags[other]))
+                for other in ids]
+
+
+class SparseIndex:
+    """Разреженная матрица рецепт × ингредиент (SciPy) и плотная матрица
+    рецепт × тег.
+
+    Строки меняются по одной в LIL-матрице; CSR-копия и транспонированная
+    матрица (обратный индекс) пересобираются в C только после изменений.
+    Пересечения для пачки рецептов — одно произведение матриц.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.row_ids = []
+        self.matrix = sparse.lil_matrix((0, 0))
+        self.tag_matrix = np.zeros((0, 0), dtype=bool)
+        self.frozen = None
+
+    def __contains__(self, recipe_id):
+        row = self.rows.get(recipe_id)
+        return row is not None and bool(self.matrix.rows[row])
+
+    def reserve(self, rows, columns, tag_columns):
+        """Растит матрицы с запасом, чтобы не копировать их на каждой
+        новой строке."""
+        capacity, width = self.matrix.shape
+        if rows > capacity:
+            capacity = max(rows, capacity * 2, 64)
+        if (capacity, max(columns, width)) != self.matrix.shape:
+            self.matrix.resize((capacity, max(columns, width)))
+        if (capacity, max(tag_columns, self.tag_matrix.shape[1])) != (
+                self.tag_matrix.shape):
+            tag_matrix = np.zeros(
+                (capacity, max(tag_columns, self.tag_matrix.shape[1])),
+                dtype=bool)
+            tag_matrix[:self.tag_matrix.shape[0],
+                       :self.tag_matrix.shape[1]] = self.tag_matrix
+            self.tag_matrix = tag_matrix
+
+    def set(self, recipe_id, ingredients, tags):
+        row = self.rows.get(recipe_id)
+        if row is None:
+            row = self.rows[recipe_id] = len(self.row_ids)
+            self.row_ids.append(recipe_id)
+        ingredients = sorted(ingredients)
+        self.reserve(row + 1, ingredients[-1] + 1 if ingredients else 0,
+                     max(tags, default=-1) + 1)
+        self.matrix.rows[row] = ingredients
+        self.matrix.data[row] = [1.0] * len(ingredients)
+        self.tag_matrix[row] = False
+        self.tag_matrix[row, list(tags)] = True
+        self.frozen = None
+
+    def remove(self, recipe_id):
+        row = self.rows.get(recipe_id)
+        if row is not None:
+            self.matrix.rows[row] = []
+            self.matrix.data[row] = []
+            self.tag_matrix[row] = False
+            self.frozen = None
+
+    def freeze(self):
+        if self.frozen is None:
+            matrix = self.matrix.tocsr()
+            self.frozen = (matrix, matrix.T.tocsr(), np.diff(matrix.indptr),
+                           self.tag_matrix, self.tag_matrix.sum(axis=1),
+                           np.array(self.row_ids))
+        return self.frozen
+
+    def ingredients_of(self, recipe_id):
+        return self.matrix.rows[self.rows[recipe_id]]
+
+    def coverage(self, ingredient_ids):
+        matrix, inverted, sizes, *_, row_ids = self.freeze()
+        columns = [ingredient_id for ingredient_id in ingredient_ids
+                   if 0 <= ingredient_id < inverted.shape[0]]
+        shared = np.asarray(inverted[columns].sum(axis=0)).ravel()
+        rows = np.flatnonzero(shared)
+        return row_ids[rows], shared[rows] / sizes[rows]
+
+    def scores(self, recipe_ids):
+        matrix, inverted, sizes, tags, tag_sizes, row_ids = self.freeze()
+        recipe_ids = iter(recipe_ids)
+        while True:
+            chunk = list(islice(recipe_ids, CHUNK_SIZE))
+            if not chunk:
+                return
+            rows = [self.rows[recipe_id] for recipe_id in chunk]
+            shared = (matrix[rows] @ inverted).tocsr()
+            for index, (recipe_id, row) in enumerate(zip(chunk, rows)):
+                start, end = shared.indptr[index], shared.indptr[index + 1]
+                others = shared.indices[start:end]
+                counts = shared.data[start:end]
+                keep = others != row
+                others, counts = others[keep], counts[keep]
+                shared_tags = np.count_nonzero(tags[others] & tags[row],
+                                               axis=1)
+                yield recipe_id, row_ids[others], similarity(
+                    counts, sizes[row], sizes[others], shared_tags,
+                    tag_sizes[row], tag_sizes[others])
+
+
+class RecipeVectors:
+    """Ингредиенты и теги всех рецептов в памяти процесса и k-я оценка
+    в каждом сохранённом списке похожих.
+
+    Загружаются целиком при первом обращении, дальше меняются по одному
+    рецепту. С NumPy и SciPy используется ``SparseIndex``, без них —
+    ``SetIndex``.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.index = None
+        self.lowest = {}
+
+    def load(self):
+        self.index = SparseIndex() if sparse is not None else SetIndex()
+        self.refresh(Recipes.objects.values_list('id', flat=True))
+        self.lowest = {
+            row['recipe_id']: (row['count'], row['lowest'])
+            for row in SimilarRecipe.objects.values('recipe_id').annotate(
+                count=Count('id'), lowest=Min('score')).order_by()}
+
+    def refresh(self, recipe_ids):
+        """Перечитывает ингредиенты и теги рецептов из базы."""
+        recipe_ids = set(recipe_ids)
+        ingredients = defaultdict(set)
+        tags = defaultdict(set)
+        for recipe_id, ingredient_id in AmountIngredients.objects.filter(
+                recipe_id__in=recipe_ids).values_list(
+                'recipe_id', 'ingredient_id').iterator():
+            ingredients[recipe_id].add(ingredient_id)
+        for recipe_id, tag_id in Recipes.tags.through.objects.filter(
+                recipes_id__in=recipe_ids).values_list(
+                'recipes_id', 'tags_id').iterator():
+            tags[recipe_id].add(tag_id)
+        for recipe_id in recipe_ids:
+            if ingredients[recipe_id]:
+                self.index.set(recipe_id, ingredients[recipe_id],
+                               tags[recipe_id])
+            else:
+                self.index.remove(recipe_id)
+
+    def admits(self, recipe_id, score):
+        """Попадёт ли рецепт с такой оценкой в список ``recipe_id``."""
+        count, lowest = self.lowest.get(recipe_id, (0, 0))
+        return count < settings.SIMILAR_RECIPES_COUNT or score >= lowest
+
+    def top(self, recipe_ids):
+        count = settings.SIMILAR_RECIPES_COUNT
+        return {recipe_id: ranked(ids, scores, count)
+                for recipe_id, ids, scores in self.index.scores(recipe_ids)}
+
+    def save(self, results, fresh=False):
+        """Заменяет сохранённые списки похожих.
+
+        Рецепты, удалённые после загрузки индекса, выбрасываются из него,
+        а списки, где они были, считаются заново. ``fresh`` — индекс
+        только что загружен и таблица пуста, проверять нечего.
+        """
+        checked, existing = set(), set()
+        while not fresh:
+            new = set(results).union(*(
+                (similar_id for similar_id, _ in top)
+                for top in results.values())) - checked
+            if not new:
+                break
+            existing.update(Recipes.objects.filter(id__in=new).values_list(
+                'id', flat=True))
+            checked |= new
+            missing = checked - existing
+            for recipe_id in missing:
+                self.index.remove(recipe_id)
+            stale = [recipe_id for recipe_id, top in results.items()
+                     if any(similar_id in missing for similar_id, _ in top)]
+            results = {recipe_id: top for recipe_id, top in results.items()
+                       if recipe_id in existing}
+            results.update(self.top(recipe_id for recipe_id in stale
+                                    if recipe_id in existing))
+        if not fresh:
+            SimilarRecipe.objects.filter(recipe_id__in=results).delete()
+        SimilarRecipe.objects.bulk_create(
+            (SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                           score=score)
+             for recipe_id, top in results.items()
+             for similar_id, score in top),
+            batch_size=5000)
+        for recipe_id, top in results.items():
+            self.lowest[recipe_id] = (len(top), top[-1][1] if top else 0)
+
+
+recipe_vectors = RecipeVectors()
+
+
+def update_similar(recipe_ids):
+    """Пересчитывает списки похожих для изменённых рецептов и для тех,
+    в чьи списки изменённый рецепт входил или теперь попадает."""
+    vectors = recipe_vectors
+    recipe_ids = set(recipe_ids)
+    with vectors.lock:
+        if vectors.index is None:
+            vectors.load()
+        else:
+            vectors.refresh(recipe_ids)
+        affected = set(SimilarRecipe.objects.filter(
+            similar_id__in=recipe_ids).values_list('recipe_id', flat=True))
+        changed = [recipe_id for recipe_id in recipe_ids
+                   if recipe_id in vectors.index]
+        count = settings.SIMILAR_RECIPES_COUNT
+        results = {}
+        for recipe_id, ids, scores in vectors.index.scores(changed):
+            results[recipe_id] = ranked(ids, scores, count)
+            affected.update(
+                int(other) for other, score in zip(ids, scores)
+                if vectors.admits(int(other), score))
+        affected = {recipe_id for recipe_id in affected - recipe_ids
+                    if recipe_id in vectors.index}
+        results.update(vectors.top(affected))
+        with transaction.atomic():
+            vectors.save(results)
+            SimilarRecipe.objects.filter(
+                recipe_id__in=recipe_ids - set(results)).delete()
+
+
+def rebuild_similar():
+    """Полный пересчёт: индекс заново из базы, списки для всех рецептов."""
+    started = timezone.now()
+    vectors = recipe_vectors
+    with vectors.lock:
+        vectors.load()
+        recipe_ids = list(Recipes.objects.values_list('id', flat=True))
+        results = vectors.top(recipe_id for recipe_id in recipe_ids
+                              if recipe_id in vectors.index)
+        with transaction.atomic():
+            SimilarRecipe.objects.all().delete()
+            vectors.save(results, fresh=True)
+            Recipes.objects.filter(updated__lte=started).update(
+                similar_updated=started)
+    return len(results)
+
+
+def process_pending(batch_size=BATCH_SIZE):
+    """Обрабатывает пачку рецептов с изменёнными ингредиентами или тегами.
+
+    Отметка снимается, только если рецепт не менялся во время пересчёта.
+    Возвращает число обработанных рецептов.
+    """
+    pending = dict(Recipes.objects.filter(
+        similar_updated__isnull=True).order_by('pk').values_list(
+        'pk', 'updated')[:batch_size])
+    if not pending:
+        return 0
+    update_similar(pending)
+    now = timezone.now()
+    for recipe_id, updated in pending.items():
+        Recipes.objects.filter(pk=recipe_id, updated=updated).update(
+            similar_updated=now)
+    return len(pending)
+
+
+def run_in_thread():
+    close_old_connections()
+    try:
+        process_pending()
+    except Exception:
+        logger.exception('Не удалось пересчитать похожие рецепты')
+    finally:
+        close_old_connections()
+
+
+def schedule_similar_update():
+    """Ставит пересчёт похожих рецептов после коммита транзакции.
+
+    ``SIMILAR_PROCESSING``: ``thread`` — поток в процессе, ``queue`` —
+    команда ``update_similar``, ``sync`` — сразу.
+    """
+    mode = settings.SIMILAR_PROCESSING
+    if mode == 'thread':
+        transaction.on_commit(lambda: executor.submit(run_in_thread))
+    elif mode == 'sync':
+        transaction.on_commit(process_pending)
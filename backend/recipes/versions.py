@@ -0,0 +1,33 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import CatalogVersion
+
+INGREDIENTS = 'ingredients'
+TAGS = 'tags'
+
+
+def get_version(name):
+    """Версия каталога: хранится в базе, общей для всех процессов, и
+    кешируется на CATALOG_VERSION_TIMEOUT секунд."""
+    key = f'version:{name}'
+    version = cache.get(key)
+    if version is None:
+        version = CatalogVersion.objects.get_or_create(
+            name=name, defaults={'version': uuid4().hex})[0].version
+        cache.set(key, version, timeout=settings.CATALOG_VERSION_TIMEOUT)
+    return version
+
+
+def bump_version(name):
+    """Меняет версию в текущей транзакции вместе с данными каталога.
+
+    Кеш сбрасывается только после фиксации: до неё другие процессы
+    прочитали бы новую версию и сохранили под ней старые данные.
+    """
+    CatalogVersion.objects.update_or_create(
+        name=name, defaults={'version': uuid4().hex})
+    transaction.on_commit(lambda: cache.delete(f'version:{name}'))
@@ -3,9 +3,28 @@ from django.db import models
 from django.db.models import UniqueConstraint
 
 
-class User(AbstractUser):
+class CountersMixin:
+    """Полное сохранение не пишет поля-счётчики.
+
+    Счётчики меняются только UPDATE с F() (recipes/counters.py), а
+    значение в загруженном объекте к моменту save() могло устареть.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not kwargs.get('force_insert')
+                and kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields]
+        super().save(*args, **kwargs)
+
+
+class User(CountersMixin, AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
+    counter_fields = ('recipes_count', 'followers_count')
 
     email = models.EmailField(verbose_name='Почта',
                               max_length=254,
@@ -18,6 +37,12 @@ class User(AbstractUser):
                                  max_length=150)
     password = models.CharField(verbose_name='Пароль',
                                 max_length=150)
+    recipes_count = models.PositiveIntegerField(verbose_name='Рецептов',
+                                                default=0,
+                                                editable=False)
+    followers_count = models.PositiveIntegerField(verbose_name='Подписчиков',
+                                                  default=0,
+                                                  editable=False)
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -48,6 +73,10 @@ class Follow(models.Model):
             UniqueConstraint(fields=('user', 'author'),
                              name='unique_subscription'),
         )
+        indexes = (
+            models.Index(fields=('author', 'user'),
+                         name='follow_author_user_idx'),
+        )
 
     def __str__(self):
         return str(self.user)